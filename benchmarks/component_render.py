@@ -0,0 +1,83 @@
+# Compares the allocations of the reminder buttons built as a View and rendered from a template.
+# Run from the repository root: python -m benchmarks.component_render
+from __future__ import annotations
+from typing import Any, Callable, Dict, List
+
+import asyncio
+import time
+import tracemalloc
+
+import nextcord
+
+from gunibot import encode_id
+from extensions.reminders.reminder import REMINDER_COMPONENTS
+
+RENDERS = 10000
+
+# the view as it was built before the templates
+def legacy_get_view(encoded_id: str, notification: bool) -> nextcord.ui.View:
+    view = nextcord.ui.View(timeout=0.1)
+    view.add_item(
+        nextcord.ui.Button(
+            custom_id=f'delete_reminder_{encoded_id}',
+            style=nextcord.ButtonStyle.danger,
+            emoji="🗑",
+            label="Supprimer",
+        )
+    )
+    view.add_item(
+        nextcord.ui.Button(
+            custom_id=f'notification_reminder_{encoded_id}',
+            style=nextcord.ButtonStyle.secondary,
+            emoji="🔔" if notification else "🔕",
+            label=f"Notification {'activée' if notification else 'désactivée'}",
+        )
+    )
+    view.add_item(
+        nextcord.ui.Button(
+            custom_id=f'edit_reminder_{encoded_id}',
+            style=nextcord.ButtonStyle.secondary,
+            emoji="✏",
+            label="Modifier le rappel",
+        )
+    )
+    return view
+
+def legacy_render(id: int) -> List[Dict[str, Any]]:
+    return legacy_get_view(encode_id(id), id % 2 == 0).to_components()
+
+def template_render(id: int) -> List[Dict[str, Any]]:
+    return REMINDER_COMPONENTS[id % 2 == 0].render(encode_id(id)).to_components()
+
+def measure(name: str, render: Callable[[int], List[Dict[str, Any]]]) -> None:
+    # the payloads are kept alive, like the messages waiting to be sent
+    payloads = []
+    peaks = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    for id in range(RENDERS):
+        # the memory used while rendering, freed objects included
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        payloads.append(render(id))
+        peaks += tracemalloc.get_traced_memory()[1] - current
+    elapsed = time.perf_counter() - start
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    statistics = snapshot.statistics("filename")
+    blocks = sum(statistic.count for statistic in statistics)
+    size = sum(statistic.size for statistic in statistics)
+    print(
+        f"{name:<10} {blocks / RENDERS:>6.1f} blocks {size / RENDERS:>8.1f} B kept"
+        f" {peaks / RENDERS:>8.1f} B peak {elapsed / RENDERS * 1e6:>8.2f} µs (per render)"
+    )
+
+async def run() -> None:
+    # nextcord views need a running event loop
+    print(f"{RENDERS} renders of the reminder buttons")
+    measure("View", legacy_render)
+    measure("template", template_render)
+
+if __name__ == "__main__":
+    asyncio.run(run())
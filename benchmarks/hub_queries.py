@@ -0,0 +1,89 @@
+# Counts the SQL queries run by the hub lookups on a seeded database.
+# Run from the repository root: python -m benchmarks.hub_queries
+from __future__ import annotations
+from typing import Callable, List, Optional
+
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+from gunibot import Base
+from extensions.rolelink.hub import Admin, Hub, HubManager
+
+HUBS = 2000
+USER_HUBS = 200
+USER = 42
+
+class BenchmarkDatabase:
+    def __init__(self, session: sqlalchemy.orm.Session) -> None:
+        self.session = session
+        self.is_async = False
+
+class BenchmarkBot:
+    def __init__(self, session: sqlalchemy.orm.Session) -> None:
+        self.database = BenchmarkDatabase(session)
+
+    def add_orm(self, object: Base) -> None:
+        pass
+
+# the lookups as they were written before the joined queries
+def legacy_get_hubs(session: sqlalchemy.orm.Session, user: int, startswith: str = "") -> List[Hub]:
+    hubs = []
+    for admin in session.query(Admin).filter(Admin.user == user).all():
+        if admin.hub.name.startswith(startswith):
+            hubs.append(admin.hub)
+    return hubs
+
+def legacy_get_hub_by_name(session: sqlalchemy.orm.Session, name: str, user: int) -> Optional[Hub]:
+    hubs = session.query(Hub).filter(Hub.name == name).all()
+    user_hubs = []
+    for admin in session.query(Admin).filter(Admin.user == user).all():
+        if admin.hub in hubs:
+            user_hubs.append(admin.hub)
+    return user_hubs[0] if len(user_hubs) > 0 else None
+
+def seed(session: sqlalchemy.orm.Session) -> None:
+    for index in range(HUBS):
+        hub = Hub(name=f"hub {index:05}", description=None)
+        hub.admins = [Admin(user=1000 + index % 50), Admin(user=2000 + index % 7)]
+        if index % (HUBS // USER_HUBS) == 0:
+            hub.admins.append(Admin(user=USER))
+        session.add(hub)
+    session.commit()
+
+def measure(engine: sqlalchemy.engine.Engine, name: str, function: Callable[[sqlalchemy.orm.Session], object]) -> None:
+    queries = 0
+    def count(*args) -> None:
+        nonlocal queries
+        queries += 1
+
+    # a fresh session, so nothing comes from the identity map
+    with sqlalchemy.orm.Session(engine) as session:
+        sqlalchemy.event.listen(engine, "before_cursor_execute", count)
+        start = time.perf_counter()
+        result = function(session)
+        # renders need the admins of every hub
+        for hub in result if isinstance(result, list) else [result]:
+            list(hub.admins)
+        elapsed = time.perf_counter() - start
+        sqlalchemy.event.remove(engine, "before_cursor_execute", count)
+    print(f"{name:<32} {queries:>5} queries {elapsed * 1000:>9.2f} ms")
+
+def run() -> None:
+    engine = sqlalchemy.create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[Hub.__table__, Admin.__table__])
+    with sqlalchemy.orm.Session(engine) as session:
+        seed(session)
+
+    def manager(session: sqlalchemy.orm.Session) -> HubManager:
+        return HubManager(BenchmarkBot(session))
+
+    print(f"{HUBS} hubs, user {USER} administrates {USER_HUBS} of them")
+    measure(engine, "get_hubs (before)", lambda session: legacy_get_hubs(session, USER, "hub 00"))
+    measure(engine, "get_hubs (after)", lambda session: manager(session).get_hubs(USER, "hub 00"))
+    measure(engine, "get_hub_by_name (before)", lambda session: legacy_get_hub_by_name(session, "hub 01990", USER))
+    measure(engine, "get_hub_by_name (after)", lambda session: manager(session).get_hub_by_name("hub 01990", USER))
+
+if __name__ == "__main__":
+    run()
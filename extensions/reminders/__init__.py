@@ -2,17 +2,17 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 import datetime
-import base64
+import tempfile
 
 import nextcord
 from nextcord.ext import commands
-from nextcord.ext import tasks
-import sqlalchemy
 
-from .reminder_manager import ReminderManager
-from .reminder import Reminder
+from .migrations import MIGRATIONS
+from .reminder_manager import AUTOCOMPLETE_KEY, ReminderManager
+from .reminder import build_page_embed, get_page_view
+from .transfer import EXPORT_SPOOL_SIZE, ICS, JSONL, MAX_IMPORT_SIZE, PARSERS, get_format, stream_lines
 
-from gunibot import EMPTY_AUTOCOMPLETE
+from gunibot import EMPTY_AUTOCOMPLETE, decode_id, unit_of_work
 
 if TYPE_CHECKING:
     from gunibot import Gunibot
@@ -21,6 +21,17 @@ class Reminders(commands.Cog):
     def __init__(self, bot: Gunibot) -> None:
         self.bot = bot
         self.reminder_manager = ReminderManager(self.bot)
+        self.bot.add_migrations(__package__, MIGRATIONS)
+        
+        self.bot.router.add("reminder", "delete", self.delete_button)
+        self.bot.router.add("reminder", "notification", self.notification_button)
+        self.bot.router.add("reminder", "edit", self.edit_button)
+        self.bot.router.add("reminder", "previous", self.previous_button)
+        self.bot.router.add("reminder", "next", self.next_button)
+        # the buttons of the reminders sent before the router
+        self.bot.router.add_legacy("delete_reminder_", "reminder", "delete")
+        self.bot.router.add_legacy("notification_reminder_", "reminder", "notification")
+        self.bot.router.add_legacy("edit_reminder_", "reminder", "edit")
         self.bot.configuration.add_guilds(self.reminder)
         self.bot.configuration.add_guilds(self.create_timestamp)
     
@@ -36,6 +47,7 @@ class Reminders(commands.Cog):
         name="create",
         description="Créé un rappel à la date indiquée",
     )
+    @unit_of_work
     async def create_reminder(
         self,
         inter: nextcord.Interaction,
@@ -60,9 +72,9 @@ class Reminders(commands.Cog):
         )
     ) -> None:
         if scheduled.isdigit():
-            scheduled = datetime.datetime.fromtimestamp(int(scheduled))
+            scheduled = datetime.datetime.utcfromtimestamp(int(scheduled))
         try:
-            reminder = self.reminder_manager.create_reminder(
+            reminder = await self.reminder_manager.create_reminder_async(
                 user if user is not None else inter.user,
                 name,
                 scheduled,
@@ -92,6 +104,7 @@ class Reminders(commands.Cog):
         name="show",
         description="Affiche un rappel particulier.",
     )
+    @unit_of_work
     async def reminder_show(
         self,
         inter: nextcord.Interaction,
@@ -102,7 +115,10 @@ class Reminders(commands.Cog):
             autocomplete=True,
         )
     ) -> None:
-        reminder = self.reminder_manager.get_reminder_by_name(reminder_name)
+        reminder = await self.reminder_manager.get_reminder_by_name_async(
+            inter.user,
+            reminder_name,
+        )
         
         if reminder is not None:
             await inter.send(
@@ -122,68 +138,209 @@ class Reminders(commands.Cog):
                     ephemeral=True,
                 )
 
+    @reminder.subcommand(
+        name="list",
+        description="Affiche la liste de tes rappels.",
+    )
+    @unit_of_work
+    async def reminder_list(self, inter: nextcord.Interaction) -> None:
+        page = await self.reminder_manager.get_page_async(inter.user)
+        if len(page.items) == 0:
+            await inter.send(
+                "Tu n'as pas de rappels. Utilises `/reminder create` pour en créer un !",
+                ephemeral=True,
+            )
+            return
+        await inter.send(
+            embed=build_page_embed(page),
+            view=get_page_view(page),
+            ephemeral=True,
+        )
+
+    @reminder.subcommand(
+        name="import",
+        description="Importe des rappels depuis un fichier iCalendar (.ics) ou JSONL.",
+    )
+    @unit_of_work
+    async def reminder_import(
+        self,
+        inter: nextcord.Interaction,
+        file: nextcord.Attachment = nextcord.SlashOption(
+            name="fichier",
+            description="Le fichier .ics ou .jsonl contenant les rappels.",
+            required=True,
+        ),
+    ) -> None:
+        format = get_format(file.filename)
+        if format is None:
+            await inter.send(
+                "Le fichier doit être au format iCalendar (.ics) ou JSONL (.jsonl).",
+                ephemeral=True,
+            )
+            return
+        if file.size > MAX_IMPORT_SIZE:
+            await inter.send(
+                f"Le fichier est trop volumineux ({MAX_IMPORT_SIZE // (1024 * 1024)} Mo au maximum).",
+                ephemeral=True,
+            )
+            return
+        await inter.response.defer(ephemeral=True)
+        try:
+            imported, errors = await self.reminder_manager.import_reminders_async(
+                inter.user,
+                PARSERS[format](stream_lines(file.url)),
+            )
+        except OSError:
+            await inter.send("Je n'ai pas réussi à lire le fichier...", ephemeral=True)
+            return
+        except ValueError:
+            await inter.send(
+                "Un rappel du même nom a été créé pendant l'import, aucun rappel n'a été importé.",
+                ephemeral=True,
+            )
+            return
+
+        message = f"{imported} rappel(s) importé(s)."
+        if len(errors) > 0:
+            message += f"\n{len(errors)} entrée(s) ignorée(s) :"
+            for number, error in errors[:10]:
+                message += f"\n- ligne {number} : {error[:120]}"
+            if len(errors) > 10:
+                message += "\n…"
+        await inter.send(message, ephemeral=True)
+
+    @reminder.subcommand(
+        name="export",
+        description="Exporte tes rappels dans un fichier.",
+    )
+    @unit_of_work
+    async def reminder_export(
+        self,
+        inter: nextcord.Interaction,
+        format: str = nextcord.SlashOption(
+            description="Le format du fichier.",
+            choices={
+                "JSONL": JSONL,
+                "iCalendar": ICS,
+            },
+            required=False,
+            default=JSONL,
+        ),
+    ) -> None:
+        await inter.response.defer(ephemeral=True)
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as file:
+            count = await self.reminder_manager.export_reminders_async(inter.user, file, format)
+            if count == 0:
+                await inter.send(
+                    "Tu n'as pas de rappels. Utilises `/reminder create` pour en créer un !",
+                    ephemeral=True,
+                )
+                return
+            file.seek(0)
+            await inter.send(
+                f"{count} rappel(s) exporté(s).",
+                file=nextcord.File(file, filename=f"rappels.{format}"),
+                ephemeral=True,
+            )
+
     @reminder_show.on_autocomplete('reminder_name')
+    @unit_of_work
     async def reminder_autocomplete(
         self,
         inter: nextcord.Interaction,
         focused_option_value: str,
     ) -> None:
-        reminders = self.bot.database.session.query(
-            Reminder
-        ).filter(
-            Reminder.name.startswith(focused_option_value),
-            Reminder.user == inter.user.id
-        ).all()
+        names = await self.bot.autocomplete_cache.complete(
+            (inter.user.id, AUTOCOMPLETE_KEY),
+            focused_option_value,
+            lambda prefix, limit: self.reminder_manager.complete_names_async(
+                inter.user,
+                prefix,
+                limit,
+            ),
+        )
         
-        if len(reminders) > 0:
-            return [reminder.name for reminder in reminders[:25]]
+        if names is None: # superseded by a newer keystroke
+            return None
+        if len(names) > 0:
+            return names
         else:
             return [EMPTY_AUTOCOMPLETE]
     
     @commands.Cog.listener()
     async def on_ready(self) -> None:
-        self.refresh.start()
+        if not self.reminder_manager.name_index.ready:
+            with self.bot.database.session_scope():
+                self.reminder_manager.warm_index()
+        self.reminder_manager.scheduler.start()
     
-    @tasks.loop(minutes=1)
-    async def refresh(self) -> None:
-        for reminder in self.bot.database.session.query(Reminder):
-            await reminder.refresh(self.bot)
+    def cog_unload(self) -> None:
+        self.reminder_manager.scheduler.stop()
+        self.bot.router.remove("reminder")
     
-    @commands.Cog.listener()
-    async def on_interaction(self, inter: nextcord.Interaction):
-        if inter.type == nextcord.InteractionType.component:
-            custom_id = inter.data['custom_id']
+    @unit_of_work
+    async def delete_button(self, inter: nextcord.Interaction, reminder_id: str) -> None:
+        reminder = self.reminder_manager.get_reminder(reminder_id)
+        if reminder is None:
+            await inter.send("Ce rappel a déjà été supprimé.", ephemeral=True)
+            return
+
+        self.reminder_manager.delete_reminder(reminder)
 
-            if custom_id.startswith('delete_reminder_'):
-                reminder = self.reminder_manager.get_reminder(custom_id[16:])
+        await inter.response.edit_message(
+            # built once, a deleted reminder has nothing to cache
+            embed=await reminder.build_embed(self.bot),
+            view=reminder.get_view(disabled=True),
+        )
 
-                self.reminder_manager.delete_reminder(reminder)
+    @unit_of_work
+    async def notification_button(self, inter: nextcord.Interaction, reminder_id: str) -> None:
+        reminder = self.reminder_manager.get_reminder(reminder_id)
+        if reminder is None:
+            await inter.send("Ce rappel a été supprimé.", ephemeral=True)
+            return
+        
+        reminder.notification = not reminder.notification # reverse the state of the notification
+        self.bot.write_behind.stage(reminder)
+        self.bot.embed_cache.bump(reminder.embed_key)
 
-                view = reminder.get_view()
+        await inter.response.edit_message(
+            embed=await reminder.get_embed(self.bot),
+            view=reminder.get_view(),
+        )
 
-                for item in view.children: # disable all buttons
-                    if isinstance(item, nextcord.ui.Button):
-                        item.disabled = True
+    @unit_of_work
+    async def edit_button(self, inter: nextcord.Interaction, reminder_id: str) -> None:
+        reminder = self.reminder_manager.get_reminder(reminder_id)
+        if reminder is None:
+            await inter.send("Ce rappel a été supprimé.", ephemeral=True)
+            return
+        await inter.response.send_modal(reminder.get_edit_modal(inter.user, self.reminder_manager))
 
-                await inter.response.edit_message(
-                    embed=await reminder.get_embed(self.bot),
-                    view=view,
-                )
+    async def show_page(self, inter: nextcord.Interaction, cursor: str, backwards: bool) -> None:
+        page = await self.reminder_manager.get_page_async(inter.user, decode_id(cursor), backwards)
+        if len(page.items) == 0: # the reminders of the page were deleted meanwhile
+            page = await self.reminder_manager.get_page_async(inter.user)
+        if len(page.items) == 0:
+            await inter.response.edit_message(
+                content="Tu n'as plus de rappels.",
+                embed=None,
+                view=None,
+            )
+            return
+        await inter.response.edit_message(
+            embed=build_page_embed(page),
+            view=get_page_view(page),
+        )
 
-            elif custom_id.startswith('notification_reminder_'):
-                reminder = self.reminder_manager.get_reminder(custom_id[22:])
-                
-                reminder.notification = not reminder.notification # reverse the state of the notification
+    @unit_of_work
+    async def previous_button(self, inter: nextcord.Interaction, cursor: str) -> None:
+        await self.show_page(inter, cursor, backwards=True)
 
-                await inter.response.edit_message(
-                    embed=await reminder.get_embed(self.bot),
-                    view=reminder.get_view(),
-                )
+    @unit_of_work
+    async def next_button(self, inter: nextcord.Interaction, cursor: str) -> None:
+        await self.show_page(inter, cursor, backwards=False)
 
-            elif custom_id.startswith('edit_reminder_'):
-                reminder = self.reminder_manager.get_reminder(custom_id[14:])
-                await inter.response.send_modal(reminder.get_edit_modal(inter.user))
-    
     @nextcord.slash_command(
         name="timestamp",
         description="Génère un timestamp unix en fonction de la date et l'heure indiquée.",
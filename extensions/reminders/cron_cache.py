@@ -0,0 +1,45 @@
+from __future__ import annotations
+from typing import Dict
+from collections import OrderedDict
+
+import crontab
+
+class CronCache:
+    def __init__(self, maxsize: int = 1024) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, crontab.CronTab] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def get(self, expression: str) -> crontab.CronTab:
+        try:
+            compiled = self._cache[expression]
+        except KeyError:
+            self.misses += 1
+            compiled = crontab.CronTab(expression) # raises ValueError, which is not cached
+            self._cache[expression] = compiled
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(expression)
+        return compiled
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._cache),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+CRON_CACHE = CronCache()
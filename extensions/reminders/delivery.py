@@ -0,0 +1,170 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+import asyncio
+import datetime
+import time
+
+import nextcord
+
+from gunibot import RateLimiter
+
+if TYPE_CHECKING:
+    from gunibot import Gunibot
+    from .reminder import Reminder
+
+# discord allows 50 requests per second globally and 5 messages every 5 seconds per channel
+GLOBAL_RATE = 50
+CHANNEL_RATE = 1
+CHANNEL_CAPACITY = 5
+# missed occurrences listed by a delivery, within the 1024 characters of an embed field
+MAX_LISTED = 50
+
+def format_occurrences(occurrences: List[datetime.datetime]) -> str:
+    lines = [
+        nextcord.utils.format_dt(occurrence.replace(tzinfo=datetime.timezone.utc), "f")
+        for occurrence in occurrences[:MAX_LISTED]
+    ]
+    if len(occurrences) > MAX_LISTED:
+        lines.append(f"… et {len(occurrences) - MAX_LISTED} autres")
+    return "\n".join(lines)
+
+class Delivery:
+    def __init__(self, reminder: Reminder, count: int, fire: Optional[datetime.datetime] = None) -> None:
+        self.reminder = reminder
+        self.count = count
+        self.fire = fire
+        self.enqueued = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+class DeliveryPipeline:
+    def __init__(self, bot: Gunibot) -> None:
+        self.bot = bot
+        self.logger = self.bot.get_logger("reminders.delivery")
+        self.limiter = RateLimiter(
+            GLOBAL_RATE,
+            GLOBAL_RATE,
+            CHANNEL_RATE,
+            CHANNEL_CAPACITY,
+        )
+
+        self.queue: Optional[asyncio.Queue[Delivery]] = None
+        self._workers: List[asyncio.Task] = []
+        self._sending: Set[asyncio.Future] = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return len(self._workers) > 0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue is not None else 0
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        delivered = self.sent + self.failed
+        return {
+            "depth": self.depth,
+            "workers": len(self._workers),
+            "sent": self.sent,
+            "failed": self.failed,
+            "latency_avg": self.latency_total / delivered if delivered > 0 else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+    def start(self) -> None:
+        if self.running:
+            return
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self._workers = [
+            loop.create_task(self._worker())
+            for _ in range(self.bot.configuration.reminders_delivery_workers)
+        ]
+
+    def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def submit(
+        self,
+        reminder: Reminder,
+        count: int = 1,
+        fire: Optional[datetime.datetime] = None,
+    ) -> asyncio.Future:
+        delivery = Delivery(reminder, count, fire)
+        self.queue.put_nowait(delivery)
+        return delivery.future
+
+    def withdraw(self, future: asyncio.Future) -> bool:
+        # a delivery still queued is skipped by the workers, one being sent can't be stopped
+        if future in self._sending:
+            return False
+        future.cancel()
+        return True
+
+    async def _send(self, delivery: Delivery) -> None:
+        reminder = delivery.reminder
+        await self.limiter.acquire()
+        user = await reminder.get_user(self.bot)
+        if user is None:
+            raise LookupError(f"The user {reminder.user} doesn't exist anymore")
+        embed = await reminder.get_embed(self.bot)
+        if delivery.fire is not None:
+            # the reminder was advanced when it fired, its embed shows the next occurrence
+            occurrences = reminder.get_occurrences(delivery.fire, delivery.count)
+            embed.timestamp = occurrences[-1].replace(tzinfo=datetime.timezone.utc)
+            if len(occurrences) > 1:
+                embed.add_field(
+                    name="Occurrences manquées",
+                    value=format_occurrences(occurrences),
+                    inline=False,
+                )
+        elif delivery.count > 1: # queued before the occurrences were stored
+            embed.add_field(
+                name="Occurrences manquées",
+                value=f"Ce rappel a été manqué {delivery.count} fois.",
+                inline=False,
+            )
+        channel = user.dm_channel
+        if channel is None:
+            await self.limiter.acquire()
+            channel = await user.create_dm()
+        # the missed occurrences are listed in a single message,
+        # nextcord retries it by itself on a 429
+        await self.limiter.acquire(channel.id)
+        await channel.send(
+            embed=embed,
+            view=reminder.get_view(),
+        )
+
+    async def _worker(self) -> None:
+        while True:
+            delivery = await self.queue.get()
+            if delivery.future.cancelled(): # given up by the outbox
+                self.queue.task_done()
+                continue
+            self._sending.add(delivery.future)
+            try:
+                await self._send(delivery)
+            except asyncio.CancelledError:
+                delivery.future.cancel()
+                raise
+            except Exception as e:
+                self.failed += 1
+                delivery.future.set_exception(e)
+            else:
+                self.sent += 1
+                delivery.future.set_result(None)
+            finally:
+                self._sending.discard(delivery.future)
+                latency = time.monotonic() - delivery.enqueued
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                self.queue.task_done()
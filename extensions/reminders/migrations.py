@@ -0,0 +1,95 @@
+from __future__ import annotations
+import datetime
+
+import sqlalchemy
+
+from gunibot import add_column, create_index
+
+from .outbox import PENDING, ReminderDelivery
+from .reminder import Reminder
+
+def add_next_fire(connection: sqlalchemy.engine.Connection) -> None:
+    add_column(connection, Reminder.__table__.c.next_fire)
+    create_index(connection, Reminder.__table__, "ix_reminders_next_fire")
+
+def add_unique_names(connection: sqlalchemy.engine.Connection) -> None:
+    # the names used twice by a user are suffixed by the id, except the oldest one
+    first = sqlalchemy.select(
+        sqlalchemy.func.min(Reminder.id)
+    ).group_by(
+        Reminder.user,
+        Reminder.name,
+    )
+    duplicates = connection.execute(
+        sqlalchemy.select(
+            Reminder.id,
+            Reminder.name,
+        ).where(
+            Reminder.name.is_not(None),
+            Reminder.id.not_in(first),
+        )
+    ).all()
+    for id, name in duplicates:
+        connection.execute(
+            sqlalchemy.update(
+                Reminder
+            ).where(
+                Reminder.id == id,
+            ).values(name=f"{name} ({id})")
+        )
+    create_index(connection, Reminder.__table__, "ix_reminders_user_name")
+
+def add_delivery_fire(connection: sqlalchemy.engine.Connection) -> None:
+    # the deliveries already waiting show the next occurrence, as before
+    add_column(connection, ReminderDelivery.__table__.c.fire)
+
+def local_to_utc(time: datetime.datetime) -> datetime.datetime:
+    # a naive datetime is taken as local time by astimezone
+    return time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+def store_times_in_utc(connection: sqlalchemy.engine.Connection) -> None:
+    # the one-shot reminders and the retries of the outbox were stored in local time,
+    # the recurring reminders only use their time as the base of their next occurrence
+    reminders = connection.execute(
+        sqlalchemy.select(
+            Reminder.id,
+            Reminder.time,
+        ).where(
+            Reminder.scheduled.is_(None),
+            Reminder.sended == False,
+            Reminder.time.is_not(None),
+        )
+    ).all()
+    for id, time in reminders:
+        time = local_to_utc(time)
+        connection.execute(
+            sqlalchemy.update(
+                Reminder
+            ).where(
+                Reminder.id == id,
+            ).values(time=time, next_fire=time)
+        )
+    deliveries = connection.execute(
+        sqlalchemy.select(
+            ReminderDelivery.id,
+            ReminderDelivery.next_attempt,
+        ).where(
+            ReminderDelivery.status == PENDING,
+        )
+    ).all()
+    for id, next_attempt in deliveries:
+        connection.execute(
+            sqlalchemy.update(
+                ReminderDelivery
+            ).where(
+                ReminderDelivery.id == id,
+            ).values(next_attempt=local_to_utc(next_attempt))
+        )
+
+# append only, the version of the schema is the number of migrations applied
+MIGRATIONS = [
+    add_next_fire,
+    add_unique_names,
+    add_delivery_fire,
+    store_times_in_utc,
+]
@@ -0,0 +1,259 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import asyncio
+import datetime
+
+import sqlalchemy
+import nextcord
+
+from gunibot.database import Base
+
+from .delivery import DeliveryPipeline
+from .reminder import Reminder
+
+if TYPE_CHECKING:
+    from gunibot import Gunibot
+
+PENDING = "pending"
+SENT = "sent"
+DEAD = "dead"
+
+# number of deliveries drained per transaction
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = datetime.timedelta(seconds=30)
+BACKOFF_MAX = datetime.timedelta(hours=6)
+# sent deliveries are kept this long so their idempotency key still applies
+RETENTION = datetime.timedelta(days=1)
+MAX_SLEEP = 3600
+ERROR_DELAY = 10
+
+class ReminderDelivery(Base):
+    __tablename__ = "reminders_outbox"
+    __table_args__ = (
+        sqlalchemy.Index("ix_reminders_outbox_status_next_attempt", "status", "next_attempt"),
+    )
+
+    id: int = sqlalchemy.Column(
+        sqlalchemy.Integer,
+        autoincrement=True,
+        primary_key=True,
+    )
+    key: str = sqlalchemy.Column(sqlalchemy.String, nullable=False, unique=True)
+    reminder_id: int = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    user: int = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    count: int = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=1)
+    # the occurrence delivered, the reminder has moved to the next one since
+    fire: Optional[datetime.datetime] = sqlalchemy.Column(sqlalchemy.DateTime, nullable=True)
+    status: str = sqlalchemy.Column(sqlalchemy.String, nullable=False, default=PENDING)
+    attempts: int = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
+    next_attempt: datetime.datetime = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False)
+    last_error: Optional[str] = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    created: datetime.datetime = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False)
+
+    def __init__(
+        self,
+        reminder: Reminder,
+        count: int,
+        now: datetime.datetime,
+    ) -> None:
+        self.key = self.get_key(reminder)
+        self.reminder_id = reminder.id
+        self.user = reminder.user
+        self.count = count
+        self.fire = reminder.next_fire
+        self.status = PENDING
+        self.attempts = 0
+        self.next_attempt = now
+        self.created = now
+
+    @staticmethod
+    def get_key(reminder: Reminder) -> str:
+        # one delivery per reminder and occurrence
+        return f"{reminder.id}:{reminder.next_fire.isoformat()}"
+
+    def retry(self, now: datetime.datetime, error: Exception) -> None:
+        self.attempts += 1
+        self.last_error = repr(error)
+        if self.attempts >= MAX_ATTEMPTS:
+            self.status = DEAD
+        else:
+            self.next_attempt = now + min(BACKOFF_BASE * 2 ** (self.attempts - 1), BACKOFF_MAX)
+
+    def __repr__(self) -> str:
+        return f"<ReminderDelivery key={repr(self.key)} status={self.status} attempts={self.attempts}>"
+
+class ReminderDispatcher:
+    def __init__(self, bot: Gunibot) -> None:
+        self.bot = bot
+        self.logger = self.bot.get_logger("reminders.outbox")
+        self.pipeline = DeliveryPipeline(self.bot)
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.dead = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def enqueue(
+        self,
+        reminders: Dict[Reminder, int],
+        now: datetime.datetime,
+    ) -> List[ReminderDelivery]:
+        # to be committed along with the advance of the reminders
+        session = self.bot.database.session
+        keys = {ReminderDelivery.get_key(reminder): reminder for reminder in reminders}
+        existing = set()
+        if len(keys) > 0:
+            existing = {
+                key for key, in session.query(
+                    ReminderDelivery.key
+                ).filter(
+                    ReminderDelivery.key.in_(keys),
+                )
+            }
+
+        deliveries = []
+        for key, reminder in keys.items():
+            if key not in existing:
+                delivery = ReminderDelivery(reminder, reminders[reminder], now)
+                session.add(delivery)
+                deliveries.append(delivery)
+        return deliveries
+
+    def wakeup(self) -> None:
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.pipeline.start()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.pipeline.stop()
+
+    def _is_permanent(self, error: BaseException) -> bool:
+        # closed DMs or deleted accounts won't get better with retries
+        return isinstance(error, (nextcord.Forbidden, nextcord.NotFound, LookupError))
+
+    async def drain(self) -> int:
+        now = datetime.datetime.utcnow()
+        with self.bot.database.session_scope() as session:
+            deliveries: List[ReminderDelivery] = session.query(
+                ReminderDelivery
+            ).filter(
+                ReminderDelivery.status == PENDING,
+                ReminderDelivery.next_attempt <= now,
+            ).order_by(
+                ReminderDelivery.next_attempt,
+            ).limit(BATCH_SIZE).all()
+            if len(deliveries) == 0:
+                return 0
+
+            reminders = {
+                reminder.id: reminder
+                for reminder in session.query(
+                    Reminder
+                ).filter(
+                    Reminder.id.in_({delivery.reminder_id for delivery in deliveries}),
+                )
+            }
+
+            # future -> id of the delivery
+            futures: Dict[asyncio.Future, int] = {}
+            for delivery in deliveries:
+                reminder = reminders.get(delivery.reminder_id)
+                if reminder is None:
+                    delivery.status = DEAD
+                    delivery.last_error = "The reminder was deleted"
+                    continue
+                futures[self.pipeline.submit(reminder, delivery.count, delivery.fire)] = delivery.id
+
+        # no session is open while the messages are sent
+        pending = set()
+        if len(futures) > 0:
+            deadline = self.bot.configuration.reminders_delivery_deadline
+            done, pending = await asyncio.wait(futures, timeout=deadline)
+            if len(pending) > 0:
+                # the queued ones stay pending for the next drain, the ones being sent are awaited
+                sending = {future for future in pending if not self.pipeline.withdraw(future)}
+                pending -= sending
+                if len(pending) > 0:
+                    self.logger.warning(
+                        f"{len(pending)} reminders are still waiting to be sent after {deadline}s, "
+                        "they are left in the outbox"
+                    )
+                if len(sending) > 0:
+                    await asyncio.wait(sending)
+
+        now = datetime.datetime.utcnow()
+        with self.bot.database.session_scope() as session:
+            sent = {
+                delivery.id: delivery
+                for delivery in session.query(
+                    ReminderDelivery
+                ).filter(
+                    ReminderDelivery.id.in_(set(futures.values())),
+                )
+            }
+            for future, delivery_id in futures.items():
+                delivery = sent.get(delivery_id)
+                if future in pending or delivery is None:
+                    continue
+                error = future.exception() if not future.cancelled() else asyncio.CancelledError()
+                if error is None:
+                    delivery.status = SENT
+                elif self._is_permanent(error):
+                    delivery.status = DEAD
+                    delivery.last_error = repr(error)
+                else:
+                    delivery.retry(now, error)
+                if delivery.status == DEAD:
+                    self.dead += 1
+                    self.logger.warning(f"Giving up on {delivery}: {delivery.last_error}")
+
+            session.query(
+                ReminderDelivery
+            ).filter(
+                ReminderDelivery.status == SENT,
+                ReminderDelivery.created < now - RETENTION,
+            ).delete(synchronize_session=False)
+
+        return len(deliveries)
+
+    def _next_delay(self) -> float:
+        next_attempt = self.bot.database.session.query(
+            sqlalchemy.func.min(ReminderDelivery.next_attempt)
+        ).filter(
+            ReminderDelivery.status == PENDING,
+        ).scalar()
+        if next_attempt is None:
+            return MAX_SLEEP
+        return min(max((next_attempt - datetime.datetime.utcnow()).total_seconds(), 0), MAX_SLEEP)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                drained = await self.drain()
+                with self.bot.database.session_scope():
+                    delay = self._next_delay()
+            except Exception:
+                self.logger.exception("Unable to drain the reminders outbox")
+                drained = 0
+                delay = ERROR_DELAY
+
+            if drained >= BATCH_SIZE:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
@@ -1,27 +1,70 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
 
 import datetime
-import base64
 
 import sqlalchemy
 import nextcord
-import crontab
 
-from gunibot.database import Base
+from gunibot.database import Base, unit_of_work
+from gunibot.components import ComponentTemplate, RenderedComponents
+from gunibot.pagination import Page, PageTemplate
+from gunibot.router import ComponentRouter, encode_id
+
+from .cron_cache import CRON_CACHE
 
 if TYPE_CHECKING:
+    from crontab import CronTab
     from gunibot import Gunibot
+    from .reminder_manager import ReminderManager
 
 NOTIFICATION = [
     "https://emojipedia-us.s3.dualstack.us-west-1.amazonaws.com/thumbs/60/twitter/282/bell-with-slash_1f515.png",
     "https://emojipedia-us.s3.dualstack.us-west-1.amazonaws.com/thumbs/60/twitter/282/bell_1f514.png",
 ]
 
+# the buttons of a reminder, for each state of its notification
+REMINDER_COMPONENTS = {
+    notification: ComponentTemplate([
+        nextcord.ui.Button(
+            custom_id=ComponentRouter.custom_id("reminder", "delete", "{}"),
+            style=nextcord.ButtonStyle.danger,
+            emoji="🗑",
+            label="Supprimer",
+        ),
+        nextcord.ui.Button(
+            custom_id=ComponentRouter.custom_id("reminder", "notification", "{}"),
+            style=nextcord.ButtonStyle.secondary,
+            emoji="🔔" if notification else "🔕",
+            label=f"Notification {'activée' if notification else 'désactivée'}",
+        ),
+        nextcord.ui.Button(
+            custom_id=ComponentRouter.custom_id("reminder", "edit", "{}"),
+            style=nextcord.ButtonStyle.secondary,
+            emoji="✏",
+            label=f"Modifier le rappel",
+        ),
+    ])
+    for notification in (True, False)
+}
+
+# the buttons of the pages of /reminder list
+REMINDER_PAGES = PageTemplate("reminder")
+
+MISSED_SKIP = "skip"
+MISSED_ONCE = "once"
+MISSED_ALL = "all"
+
 class ReminderModal(nextcord.ui.Modal):
-    def __init__(self, reminder: Reminder, user: nextcord.User):
+    def __init__(
+        self,
+        reminder: Reminder,
+        user: nextcord.User,
+        manager: ReminderManager,
+    ):
         self.reminder = reminder
         self.user = user
+        self.manager = manager
         super().__init__(
             "Modifier un rappel",
         )
@@ -40,11 +83,41 @@ class ReminderModal(nextcord.ui.Modal):
             placeholder="Ne pas oublier de prendre mon cerveau",
             style=nextcord.TextInputStyle.paragraph,
         )
-        # TODO: ajouter le "scheduled"
+        self.scheduled = nextcord.ui.TextInput(
+            label="Programmation (crontab ou timestamp)",
+            max_length=100,
+            required=True,
+            default_value=reminder.scheduled if reminder.scheduled is not None else str(int(
+                # stored as naive UTC, read back by utcfromtimestamp
+                reminder.time.replace(tzinfo=datetime.timezone.utc).timestamp()
+            )),
+            placeholder="0 8 * * 1-5",
+        )
         
         self.add_item(self.name)
         self.add_item(self.description)
+        self.add_item(self.scheduled)
     
+    def edit(self, bot: Gunibot, scheduled: Union[datetime.datetime, str]) -> Optional[Reminder]:
+        # the reminder was loaded by the session of another interaction
+        reminder = bot.write_behind.overlay(
+            bot.database.session.get(Reminder, self.reminder.id),
+        )
+        if reminder is None:
+            return None
+        # a rename is written at once, the unique index must accept it
+        renamed = self.name.value != reminder.name
+        self.manager.edit_reminder(
+            reminder,
+            self.name.value,
+            self.description.value,
+            scheduled,
+        )
+        if not renamed:
+            bot.write_behind.stage(reminder)
+        return reminder
+
+    @unit_of_work
     async def callback(self, inter: nextcord.Interaction):
         if inter.user != self.user:
             await inter.send(
@@ -52,8 +125,37 @@ class ReminderModal(nextcord.ui.Modal):
                 ephemeral=True,
             )
             return
-        self.reminder.name = self.name.value
-        self.reminder.description = self.description.value
+        try:
+            scheduled = self.manager.parse_scheduled(self.scheduled.value)
+            if inter.client.database.is_async:
+                # reloaded and written by the async session
+                reminder = await self.manager.edit_reminder_async(
+                    self.reminder,
+                    self.name.value,
+                    self.description.value,
+                    scheduled,
+                )
+            else:
+                reminder = self.edit(inter.client, scheduled)
+        except SyntaxError:
+            await inter.send(
+                "Il y a une erreur dans la syntaxe crontab.",
+                ephemeral=True,
+            )
+            return
+        except ValueError:
+            await inter.send(
+                "Vous avez déjà un rappel avec ce nom. Utilisez en un autre !",
+                ephemeral=True,
+            )
+            return
+        if reminder is None:
+            await inter.send(
+                "Ce rappel a été supprimé entre temps.",
+                ephemeral=True,
+            )
+            return
+        self.reminder = reminder
         try:
             await inter.response.edit_message(
                 embed=await self.reminder.get_embed(inter.client),
@@ -69,6 +171,10 @@ class ReminderModal(nextcord.ui.Modal):
 
 class Reminder(Base):
     __tablename__ = "reminders"
+    __table_args__ = (
+        # a user can't have two reminders with the same name
+        sqlalchemy.Index("ix_reminders_user_name", "user", "name", unique=True),
+    )
     
     id = sqlalchemy.Column(
         sqlalchemy.Integer,
@@ -94,6 +200,11 @@ class Reminder(Base):
         nullable=False,
         default=True,
     )
+    next_fire: Optional[datetime.datetime] = sqlalchemy.Column(
+        sqlalchemy.DateTime,
+        nullable=True,
+        index=True,
+    )
     
     def __init__(
         self,
@@ -114,10 +225,11 @@ class Reminder(Base):
         self.scheduled = scheduled
         self.sended = sended
         self.notification = notification
+        self.update_next_fire()
     
     @property
     def encoded_id(self) -> str:
-        return base64.b64encode(self.id.to_bytes(4, byteorder='little')).decode('utf-8')
+        return encode_id(self.id)
     
     async def get_user(self, bot: Gunibot) -> Optional[nextcord.User]:
         return await bot.get_or_fetch_user(self.user)
@@ -129,15 +241,16 @@ class Reminder(Base):
             return await self.get_user(bot)
 
     def next(self) -> datetime.datetime:
-        if self.crontab is not None:
+        crontab = self.crontab
+        if crontab is not None:
             if self.time is not None:
-                return self.crontab.next(
+                return crontab.next(
                     self.time,
                     return_datetime=True,
                     default_utc=True,
                 )
             else:
-                return self.crontab.next(
+                return crontab.next(
                     return_datetime=True,
                     default_utc=True,
                 )
@@ -145,46 +258,94 @@ class Reminder(Base):
             return self.time
 
     @property
-    def crontab(self) -> Optional[crontab.CronTab]:
+    def finished(self) -> bool:
+        return self.sended and self.scheduled is None
+
+    def update_next_fire(self) -> None:
+        # materialized so the database can answer "which reminders are due"
+        self.next_fire = None if self.finished else self.next()
+
+    @property
+    def crontab(self) -> Optional[CronTab]:
         if self.scheduled is not None:
-            return crontab.CronTab(self.scheduled)
+            return CRON_CACHE.get(self.scheduled)
         return None
 
-    async def refresh(self, bot: Gunibot) -> None:
+    def pending_fires(
+        self,
+        now: datetime.datetime,
+        policy: str = MISSED_ONCE,
+        cap: int = 10,
+        grace: datetime.timedelta = datetime.timedelta(minutes=2),
+    ) -> int:
         next = self.next()
-        now = datetime.datetime.now()
-        if now >= next:
-            if not self.sended or self.scheduled is not None:
-                if self.notification:
-                    user = await self.get_user(bot)
-                    await user.send(
-                        embed=await self.get_embed(bot),
-                        view=self.get_view(),
-                    )
-                
-                if self.scheduled is None:
-                    self.sended = True
-                else:
-                    crontab = self.crontab
-                    time = self.time
-                    while crontab.next(
-                            time,
-                            return_datetime=True,
-                            default_utc=True,
-                        ) < now:
-                        time = crontab.next(
-                            time,
-                            return_datetime=True,
-                            default_utc=True,
-                        )
-                    self.time = time
-        
+        if self.finished or next is None or now < next:
+            return 0
+        if now - next <= grace: # on time, nothing was missed
+            return 1
+
+        if policy == MISSED_SKIP:
+            if self.scheduled is None:
+                return 0
+            latest = self.crontab.previous(
+                now,
+                return_datetime=True,
+                default_utc=True,
+            )
+            return 1 if latest is not None and now - latest <= grace else 0
+        elif policy == MISSED_ALL and self.scheduled is not None:
+            crontab = self.crontab
+            count = 1
+            while count < cap:
+                next = crontab.next(
+                    next,
+                    return_datetime=True,
+                    default_utc=True,
+                )
+                if next is None or next > now:
+                    break
+                count += 1
+            return count
+        return 1
+
+    def get_occurrences(self, first: datetime.datetime, count: int) -> List[datetime.datetime]:
+        # the occurrences fired at once by the "all" policy, from the first one missed
+        occurrences = [first]
+        crontab = self.crontab
+        while crontab is not None and len(occurrences) < count:
+            next = crontab.next(
+                occurrences[-1],
+                return_datetime=True,
+                default_utc=True,
+            )
+            if next is None:
+                break
+            occurrences.append(next)
+        return occurrences
+
+    def advance(self, now: datetime.datetime) -> None:
+        if self.scheduled is None:
+            self.sended = True
+        else:
+            # jump straight to the first occurrence after now
+            self.time = now
+        self.update_next_fire()
+
+    @property
+    def embed_key(self) -> Tuple[str, int]:
+        return ("reminder", self.id)
+
     async def get_embed(self, bot: Gunibot) -> nextcord.Embed:
+        return await bot.embed_cache.get(self.embed_key, lambda: self.build_embed(bot))
+
+    async def build_embed(self, bot: Gunibot) -> nextcord.Embed:
+        next = self.next()
         embed = nextcord.Embed(
             title=f"Rappel : {self.name}",
             color=0xF76000,
             description=self.description if self.description is not None else "",
-            timestamp=self.next(),
+            # nextcord takes the naive datetimes as local times, they are stored in UTC
+            timestamp=next.replace(tzinfo=datetime.timezone.utc) if next is not None else None,
         )
         embed.set_footer(
             text=self.scheduled,
@@ -194,46 +355,45 @@ class Reminder(Base):
         if author is not None:
             embed.set_author(
                 name=f"{author.name}#{author.discriminator}",
-                icon_url=author.avatar.url,
+                icon_url=author.display_avatar.url,
             )
         embed.set_thumbnail(
             url="https://emojipedia-us.s3.dualstack.us-west-1.amazonaws.com/thumbs/160/twitter/282/clipboard_1f4cb.png",
         )
         return embed
 
-    def get_view(self) -> nextcord.ui.View:
-        view = nextcord.ui.View(timeout=0.1)
-        view.add_item(
-            nextcord.ui.Button(
-                custom_id=f'delete_reminder_{self.encoded_id}',
-                style=nextcord.ButtonStyle.danger,
-                emoji="🗑",
-                label="Supprimer",
-            )
-        )
-        view.add_item(
-            nextcord.ui.Button(
-                custom_id=f'notification_reminder_{self.encoded_id}',
-                style=nextcord.ButtonStyle.secondary,
-                emoji="🔔" if self.notification else "🔕",
-                label=f"Notification {'activée' if self.notification else 'désactivée'}",
-            )
-        )
-        view.add_item(
-            nextcord.ui.Button(
-                custom_id=f'edit_reminder_{self.encoded_id}',
-                style=nextcord.ButtonStyle.secondary,
-                emoji="✏",
-                label=f"Modifier le rappel",
-            )
-        )
-        return view
+    def get_view(self, disabled: bool = False) -> RenderedComponents:
+        return REMINDER_COMPONENTS[self.notification].render(self.encoded_id, disabled=disabled)
 
-    def get_edit_modal(self, user: nextcord.User):
+    def get_edit_modal(self, user: nextcord.User, manager: ReminderManager):
         return ReminderModal(
             self,
             user,
+            manager,
         )
 
     def __repr__(self) -> str:
         return f"<Reminder id={repr(self.id)} name={repr(self.name)} time={repr(self.time)} scheduled={repr(self.scheduled)} next={self.next()} sended={self.sended}>"
+
+def build_page_embed(page: Page[Reminder]) -> nextcord.Embed:
+    embed = nextcord.Embed(
+        title="Tes rappels",
+        color=0xF76000,
+    )
+    for reminder in page.items:
+        if reminder.next_fire is not None:
+            # the times are stored in UTC
+            value = nextcord.utils.format_dt(reminder.next_fire.replace(tzinfo=datetime.timezone.utc), "R")
+        else:
+            value = "Terminé"
+        if reminder.scheduled is not None:
+            value += f" (`{reminder.scheduled}`)"
+        embed.add_field(
+            name=f"{'🔔' if reminder.notification else '🔕'} {reminder.name}",
+            value=value,
+            inline=False,
+        )
+    return embed
+
+def get_page_view(page: Page[Reminder]) -> RenderedComponents:
+    return REMINDER_PAGES.render(page, page.items[0].id, page.items[-1].id)
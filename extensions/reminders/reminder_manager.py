@@ -1,24 +1,41 @@
 from __future__ import annotations
+import contextlib
 import datetime
-from typing import TYPE_CHECKING, Optional, Union
-import base64
+from typing import TYPE_CHECKING, Any, AsyncIterator, BinaryIO, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 import nextcord
 import sqlalchemy
-from crontab import CronTab
+from gunibot import PAGE_SIZE, Page, PrefixIndex, decode_id
 
+from .cron_cache import CRON_CACHE
+from .outbox import ReminderDelivery
 from .reminder import Reminder
+from .scheduler import ReminderScheduler
+from .transfer import SERIALIZERS, Entry
 
 if TYPE_CHECKING:
     from gunibot import Gunibot
 
+# the key of the autocompletion of the reminder names, with the user id
+AUTOCOMPLETE_KEY = "reminder"
+
+# imported reminders checked against the database at once
+IMPORT_BATCH_SIZE = 500
+# reminders imported from a single file
+MAX_IMPORT = 10000
+# exported reminders loaded per fetch
+EXPORT_BATCH_SIZE = 500
+
 class ReminderManager:
     def __init__(self, bot: Gunibot) -> None:
         self.bot = bot
+        self.scheduler = ReminderScheduler(self.bot)
+        self.name_index = PrefixIndex()
         
         bot.add_orm(Reminder)
+        bot.add_orm(ReminderDelivery)
     
-    def create_reminder(
+    def new_reminder(
         self,
         user: Union[int, nextcord.User, nextcord.Member],
         name: str,
@@ -32,17 +49,8 @@ class ReminderManager:
         if isinstance(author, (nextcord.User, nextcord.Member)):
             author = author.id
         
-        check_duplicate = self.bot.database.session.query(
-            Reminder
-        ).filter(
-            Reminder.user == user,
-            Reminder.name == name,
-        ).all()
-        if len(check_duplicate):
-            raise ValueError("The name is already used")
-        
         if isinstance(scheduled, datetime.datetime):
-            reminder = Reminder(
+            return Reminder(
                 user=user,
                 name=name,
                 description = description,
@@ -51,54 +59,601 @@ class ReminderManager:
                 notification=notification,
             )
         else:
+            self.check_scheduled(scheduled)
+            return Reminder(
+                user=user,
+                name=name,
+                description = description,
+                time=datetime.datetime.utcnow(),
+                scheduled=scheduled,
+                author=author,
+                notification=notification,
+            )
+
+    def create_reminder(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        name: str,
+        scheduled: Union[datetime.datetime, str],
+        description: Optional[str] = None,
+        notification: bool = True,
+        author: Union[int, nextcord.User, nextcord.Member] = None,
+    ) -> Reminder:
+        reminder = self.new_reminder(
+            user,
+            name,
+            scheduled,
+            description,
+            notification,
+            author,
+        )
+        
+        self.write_deletes()
+        # the unique index on (user, name) rejects the duplicates
+        self.bot.database.session.add(
+            reminder,
+        )
+        try:
+            self.bot.database.session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            self.bot.database.session.rollback()
+            raise ValueError("The name is already used")
+        self.scheduler.schedule(reminder)
+        self.name_index.add(reminder.user, reminder.name)
+        self.names_changed(reminder.user)
+        return reminder
+
+    async def create_reminder_async(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        name: str,
+        scheduled: Union[datetime.datetime, str],
+        description: Optional[str] = None,
+        notification: bool = True,
+        author: Union[int, nextcord.User, nextcord.Member] = None,
+    ) -> Reminder:
+        if not self.bot.database.is_async:
+            return self.create_reminder(
+                user,
+                name,
+                scheduled,
+                description,
+                notification,
+                author,
+            )
+        
+        reminder = self.new_reminder(
+            user,
+            name,
+            scheduled,
+            description,
+            notification,
+            author,
+        )
+        self.write_deletes()
+        async with self.bot.database.async_session() as session:
+            session.add(reminder)
             try:
-                cron = CronTab(scheduled)
-            except ValueError:
-                raise SyntaxError("The specified cron scheme is invalid")
-            else:
-                reminder = Reminder(
-                    user=user,
-                    name=name,
-                    description = description,
-                    time=datetime.datetime.utcnow(),
-                    scheduled=scheduled,
-                    author=author,
-                    notification=notification,
-                )
-                self.bot.database.session.add(
-                    reminder,
-                )
-                self.bot.database.session.commit()
-                return reminder
+                await session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                raise ValueError("The name is already used")
+        self.scheduler.schedule(reminder)
+        self.name_index.add(reminder.user, reminder.name)
+        self.names_changed(reminder.user)
+        return reminder
+
+    def write_deletes(self) -> None:
+        # a reminder deleted behind keeps its name in the database until it's written
+        if self.bot.write_behind.is_deleting(Reminder):
+            self.bot.write_behind.flush()
+
+    def names_changed(self, user: int) -> None:
+        self.bot.autocomplete_cache.invalidate((user, AUTOCOMPLETE_KEY))
+
+    def check_scheduled(self, scheduled: str) -> None:
+        try:
+            CRON_CACHE.get(scheduled)
+        except ValueError:
+            raise SyntaxError("The specified cron scheme is invalid")
+
+    def parse_scheduled(self, scheduled: str) -> Union[datetime.datetime, str]:
+        if scheduled.isdigit():
+            return datetime.datetime.utcfromtimestamp(int(scheduled))
+        self.check_scheduled(scheduled)
+        return scheduled
+
+    def edit_reminder(
+        self,
+        reminder: Reminder,
+        name: str,
+        description: Optional[str] = None,
+        scheduled: Union[datetime.datetime, str, None] = None,
+    ) -> Reminder:
+        if name != reminder.name:
+            self.write_deletes()
+            old_name = reminder.name
+            reminder.name = name
+            try:
+                self.bot.database.session.flush()
+            except sqlalchemy.exc.IntegrityError:
+                self.bot.database.session.rollback()
+                raise ValueError("The name is already used")
+            self.name_index.rename(reminder.user, old_name, name)
+            self.names_changed(reminder.user)
+        self.set_content(reminder, description, scheduled)
+        self.scheduler.schedule(reminder)
+        self.bot.embed_cache.bump(reminder.embed_key)
+        return reminder
+
+    def set_content(
+        self,
+        reminder: Reminder,
+        description: Optional[str] = None,
+        scheduled: Union[datetime.datetime, str, None] = None,
+    ) -> None:
+        reminder.description = description
+        if isinstance(scheduled, datetime.datetime):
+            if scheduled != reminder.time or reminder.scheduled is not None:
+                reminder.time = scheduled
+                reminder.scheduled = None
+                reminder.sended = False
+        elif scheduled is not None and scheduled != reminder.scheduled:
+            self.check_scheduled(scheduled)
+            reminder.time = datetime.datetime.utcnow()
+            reminder.scheduled = scheduled
+            reminder.sended = False
+        reminder.update_next_fire()
 
-    def get_reminder_by_id(self, raw_reminder_id: str) -> int:
-        bytes = base64.b64decode(raw_reminder_id)
-        return int.from_bytes(bytes, byteorder='little')
+    async def edit_reminder_async(
+        self,
+        reminder: Reminder,
+        name: str,
+        description: Optional[str] = None,
+        scheduled: Union[datetime.datetime, str, None] = None,
+    ) -> Optional[Reminder]:
+        if not self.bot.database.is_async:
+            return self.edit_reminder(reminder, name, description, scheduled)
+        self.write_deletes()
+        # edited in the async session only, the sync session never sees the object
+        async with self.bot.database.async_session() as session:
+            reminder = self.bot.write_behind.overlay(await session.get(Reminder, reminder.id))
+            if reminder is None:
+                return None
+            old_name = reminder.name
+            reminder.name = name
+            self.set_content(reminder, description, scheduled)
+            try:
+                await session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                raise ValueError("The name is already used")
+        if name != old_name:
+            self.name_index.rename(reminder.user, old_name, name)
+            self.names_changed(reminder.user)
+        self.scheduler.schedule(reminder)
+        self.bot.embed_cache.bump(reminder.embed_key)
+        return reminder
 
     def get_reminder(self, raw_reminder_id: str) -> Reminder:
-        reminder_id = self.get_reminder_by_id(raw_reminder_id)
+        reminder_id = decode_id(raw_reminder_id)
         try:
-            return self.bot.database.session.query(
-                Reminder
-            ).filter(Reminder.id==reminder_id).one()
+            return self.bot.write_behind.overlay(
+                self.bot.database.session.query(
+                    Reminder
+                ).filter(Reminder.id==reminder_id).one()
+            )
         except sqlalchemy.exc.NoResultFound:
             return None
 
+    async def get_reminder_async(self, raw_reminder_id: str) -> Optional[Reminder]:
+        if not self.bot.database.is_async:
+            return self.get_reminder(raw_reminder_id)
+        async with self.bot.database.async_session() as session:
+            return self.bot.write_behind.overlay(await session.get(
+                Reminder,
+                decode_id(raw_reminder_id),
+            ))
+
     def get_reminder_by_name(
         self,
+        user: Union[int, nextcord.User, nextcord.Member],
         name: str,
     ) -> Optional[Reminder]:
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
         try:
             reminder = self.bot.database.session.query(
                 Reminder
             ).filter(
-                Reminder.name == name
+                Reminder.user == user,
+                Reminder.name == name,
             ).one()
             
-            return reminder
+            return self.bot.write_behind.overlay(reminder)
         except sqlalchemy.orm.exc.NoResultFound:
             return None
+
+    async def get_reminder_by_name_async(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        name: str,
+    ) -> Optional[Reminder]:
+        if not self.bot.database.is_async:
+            return self.get_reminder_by_name(user, name)
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        async with self.bot.database.async_session() as session:
+            try:
+                return self.bot.write_behind.overlay((await session.execute(
+                    sqlalchemy.select(
+                        Reminder
+                    ).where(
+                        Reminder.user == user,
+                        Reminder.name == name,
+                    )
+                )).scalar_one())
+            except sqlalchemy.exc.NoResultFound:
+                return None
+
+    def warm_index(self) -> None:
+        self.name_index.warm(
+            self.bot.database.session.query(
+                Reminder.user,
+                Reminder.name,
+            )
+        )
+
+    async def complete_names_async(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        startswith: str = "",
+        limit: int = 25,
+    ) -> List[str]:
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        if self.name_index.ready:
+            return self.name_index.search(user, startswith, limit)
+        # the index is still cold
+        return [
+            reminder.name
+            for reminder in await self.get_reminders_async(user, startswith, limit)
+        ]
+
+    def get_reminders(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        startswith: str = "",
+        limit: int = 25,
+    ) -> List[Reminder]:
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        return self.bot.database.session.query(
+            Reminder
+        ).filter(
+            Reminder.name.startswith(startswith),
+            Reminder.user == user,
+        ).limit(limit).all()
+
+    async def get_reminders_async(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        startswith: str = "",
+        limit: int = 25,
+    ) -> List[Reminder]:
+        if not self.bot.database.is_async:
+            return self.get_reminders(user, startswith, limit)
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        async with self.bot.database.async_session() as session:
+            return (await session.execute(
+                sqlalchemy.select(
+                    Reminder
+                ).where(
+                    Reminder.name.startswith(startswith),
+                    Reminder.user == user,
+                ).limit(limit)
+            )).scalars().all()
     
-    
+
+    def select_page(
+        self,
+        user: int,
+        cursor: Optional[int] = None,
+        backwards: bool = False,
+        limit: int = PAGE_SIZE,
+    ) -> sqlalchemy.sql.Select:
+        # seeks on the (user, name) index from the name of the cursor reminder
+        query = sqlalchemy.select(
+            Reminder
+        ).where(
+            Reminder.user == user,
+        )
+        if cursor is not None:
+            name = sqlalchemy.select(
+                Reminder.name
+            ).where(
+                Reminder.id == cursor,
+            ).scalar_subquery()
+            query = query.where(Reminder.name < name if backwards else Reminder.name > name)
+        return query.order_by(
+            Reminder.name.desc() if backwards else Reminder.name,
+        ).limit(limit + 1)
+
+    def get_page(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        cursor: Optional[int] = None,
+        backwards: bool = False,
+        limit: int = PAGE_SIZE,
+    ) -> Page[Reminder]:
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        rows = self.bot.database.session.execute(
+            self.select_page(user, cursor, backwards, limit)
+        ).scalars()
+        return Page.from_rows(
+            (reminder for reminder in map(self.bot.write_behind.overlay, rows) if reminder is not None),
+            limit,
+            cursor,
+            backwards,
+        )
+
+    async def get_page_async(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        cursor: Optional[int] = None,
+        backwards: bool = False,
+        limit: int = PAGE_SIZE,
+    ) -> Page[Reminder]:
+        if not self.bot.database.is_async:
+            return self.get_page(user, cursor, backwards, limit)
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        async with self.bot.database.async_session() as session:
+            rows = (await session.execute(
+                self.select_page(user, cursor, backwards, limit)
+            )).scalars()
+            return Page.from_rows(
+                (reminder for reminder in map(self.bot.write_behind.overlay, rows) if reminder is not None),
+                limit,
+                cursor,
+                backwards,
+            )
+
     def delete_reminder(self, reminder: Reminder) -> None:
-        self.bot.database.session.delete(reminder)
+        self.scheduler.unschedule(reminder)
+        self.name_index.remove(reminder.user, reminder.name)
+        self.names_changed(reminder.user)
+        self.bot.embed_cache.bump(reminder.embed_key)
+        self.bot.write_behind.delete(reminder)
+
+    async def delete_reminder_async(self, reminder: Reminder) -> None:
+        if not self.bot.database.is_async:
+            return self.delete_reminder(reminder)
+        self.scheduler.unschedule(reminder)
+        self.name_index.remove(reminder.user, reminder.name)
+        self.names_changed(reminder.user)
+        self.bot.embed_cache.bump(reminder.embed_key)
+        async with self.bot.database.async_session() as session:
+            await session.execute(
+                sqlalchemy.delete(
+                    Reminder
+                ).where(
+                    Reminder.id == reminder.id,
+                )
+            )
+            await session.commit()
+
+    def validate_entry(
+        self,
+        user: int,
+        entry: Dict[str, Any],
+        now: datetime.datetime,
+        fires: Dict[str, datetime.datetime],
+    ) -> Dict[str, Any]:
+        # the row of an imported reminder, with the limits of the reminder modal
+        name = entry.get("name")
+        if not isinstance(name, str) or len(name.strip()) == 0:
+            raise ValueError("Le rappel n'a pas de nom")
+        if len(name) > 100:
+            raise ValueError("Le nom dépasse 100 caractères")
+        description = entry.get("description")
+        if description is not None and (not isinstance(description, str) or len(description) > 2000):
+            raise ValueError("La description doit être un texte de 2000 caractères au plus")
+        notification = entry.get("notification", True)
+        if not isinstance(notification, bool):
+            raise ValueError("La notification doit être un booléen")
+
+        row = {
+            "user": user,
+            "author": None,
+            "name": name,
+            "description": description,
+            "sended": False,
+            "notification": notification,
+        }
+        scheduled = entry.get("scheduled")
+        if scheduled is not None:
+            if not isinstance(scheduled, str):
+                raise ValueError("La syntaxe cron doit être un texte")
+            # the entries of an import share the same now, and often the same cron
+            if scheduled not in fires:
+                try:
+                    crontab = CRON_CACHE.get(scheduled)
+                except (ValueError, TypeError):
+                    raise ValueError(f"Syntaxe cron invalide : {scheduled}")
+                # as computed by Reminder.update_next_fire
+                fires[scheduled] = crontab.next(now, return_datetime=True, default_utc=True)
+            row["time"] = now
+            row["scheduled"] = scheduled
+            row["next_fire"] = fires[scheduled]
+        elif entry.get("time") is not None:
+            if entry["time"] <= now:
+                raise ValueError("La date est déjà passée")
+            row["time"] = entry["time"]
+            row["scheduled"] = None
+            row["next_fire"] = entry["time"]
+        else:
+            raise ValueError("Le rappel n'a ni date ni cron")
+        return row
+
+    def select_existing_names(self, user: int, names: List[str]) -> sqlalchemy.sql.Select:
+        return sqlalchemy.select(
+            Reminder.name
+        ).where(
+            Reminder.user == user,
+            Reminder.name.in_(names),
+        )
+
+    async def get_existing_names_async(self, user: int, names: List[str]) -> Set[str]:
+        if not self.bot.database.is_async:
+            return set(self.bot.database.session.execute(
+                self.select_existing_names(user, names)
+            ).scalars())
+        async with self.bot.database.async_session() as session:
+            return set((await session.execute(
+                self.select_existing_names(user, names)
+            )).scalars())
+
+    async def import_reminders_async(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        entries: AsyncIterator[Tuple[int, Entry]],
+    ) -> Tuple[int, List[Tuple[int, str]]]:
+        # the number of reminders imported, and the errors by line of the file
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        now = datetime.datetime.utcnow()
+        fires: Dict[str, datetime.datetime] = {}
+        rows: List[Dict[str, Any]] = []
+        errors: List[Tuple[int, str]] = []
+        names: Set[str] = set()
+        batch: List[Tuple[int, Dict[str, Any]]] = []
+        self.write_deletes()
+
+        async def check_batch() -> None:
+            # a single query for the names already used by the batch
+            existing = await self.get_existing_names_async(user, [row["name"] for _, row in batch])
+            for number, row in batch:
+                if row["name"] in existing:
+                    errors.append((number, f"Tu as déjà un rappel nommé {row['name']}"))
+                else:
+                    rows.append(row)
+            batch.clear()
+
+        # the parser and its download are closed even when the loop stops early
+        async with contextlib.aclosing(entries):
+            async for number, entry in entries:
+                if isinstance(entry, ValueError):
+                    errors.append((number, str(entry)))
+                    continue
+                if len(rows) + len(batch) >= MAX_IMPORT:
+                    errors.append((number, f"Limite de {MAX_IMPORT} rappels par import atteinte"))
+                    break
+                try:
+                    row = self.validate_entry(user, entry, now, fires)
+                except ValueError as e:
+                    errors.append((number, str(e)))
+                    continue
+                if row["name"] in names:
+                    errors.append((number, f"Le nom {row['name']} est utilisé plusieurs fois"))
+                    continue
+                names.add(row["name"])
+                batch.append((number, row))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    await check_batch()
+        if len(batch) > 0:
+            await check_batch()
+
+        if len(rows) > 0:
+            await self.insert_reminders_async(user, rows)
+        return len(rows), errors
+
+    def select_inserted(self, user: int, names: List[str]) -> sqlalchemy.sql.Select:
+        # read back by name, a reminder created meanwhile by the user is not one of them
+        return sqlalchemy.select(
+            Reminder.id,
+            Reminder.name,
+            Reminder.next_fire,
+        ).where(
+            Reminder.user == user,
+            Reminder.name.in_(names),
+        )
+
+    def insert_reminders(self, user: int, rows: List[Dict[str, Any]]) -> None:
+        # a single executemany and a single commit, instead of a transaction per reminder
+        session = self.bot.database.session
+        try:
+            session.execute(sqlalchemy.insert(Reminder), rows)
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            session.rollback()
+            raise ValueError("The name is already used")
+        names = [row["name"] for row in rows]
+        inserted = []
+        for start in range(0, len(names), IMPORT_BATCH_SIZE):
+            inserted.extend(session.execute(
+                self.select_inserted(user, names[start:start + IMPORT_BATCH_SIZE])
+            ))
+        self.schedule_inserted(user, inserted)
+
+    async def insert_reminders_async(self, user: int, rows: List[Dict[str, Any]]) -> None:
+        if not self.bot.database.is_async:
+            return self.insert_reminders(user, rows)
+        async with self.bot.database.async_session() as session:
+            try:
+                await session.execute(sqlalchemy.insert(Reminder), rows)
+                await session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                raise ValueError("The name is already used")
+            names = [row["name"] for row in rows]
+            inserted = []
+            for start in range(0, len(names), IMPORT_BATCH_SIZE):
+                inserted.extend(await session.execute(
+                    self.select_inserted(user, names[start:start + IMPORT_BATCH_SIZE])
+                ))
+            self.schedule_inserted(user, inserted)
+
+    def schedule_inserted(self, user: int, inserted: Iterable[Tuple[int, str, Optional[datetime.datetime]]]) -> None:
+        fires = []
+        for id, name, next_fire in inserted:
+            self.name_index.add(user, name)
+            fires.append((id, next_fire))
+        self.names_changed(user)
+        self.scheduler.schedule_all(fires)
+
+    def select_export(self, user: int) -> sqlalchemy.sql.Select:
+        return sqlalchemy.select(
+            Reminder
+        ).where(
+            Reminder.user == user,
+        ).order_by(
+            Reminder.name,
+        )
+
+    async def export_reminders_async(
+        self,
+        user: Union[int, nextcord.User, nextcord.Member],
+        file: BinaryIO,
+        format: str,
+    ) -> int:
+        # written as they are fetched, the reminders are never all loaded at once
+        if isinstance(user, (nextcord.User, nextcord.Member)):
+            user = user.id
+        serialize, header, footer = SERIALIZERS[format]
+        count = 0
+        file.write(header.encode())
+        if not self.bot.database.is_async:
+            for reminder in self.bot.database.session.execute(
+                self.select_export(user).execution_options(yield_per=EXPORT_BATCH_SIZE)
+            ).scalars():
+                file.write(serialize(reminder).encode())
+                count += 1
+        else:
+            async with self.bot.database.async_session() as session:
+                async for reminder in await session.stream_scalars(
+                    self.select_export(user).execution_options(yield_per=EXPORT_BATCH_SIZE)
+                ):
+                    file.write(serialize(reminder).encode())
+                    count += 1
+        file.write(footer.encode())
+        return count
@@ -0,0 +1,181 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+import asyncio
+import datetime
+import heapq
+
+import sqlalchemy
+
+from .outbox import ReminderDispatcher
+from .reminder import Reminder
+
+if TYPE_CHECKING:
+    from gunibot import Gunibot
+
+# upper bound of a single sleep, so a clock change can't stall the scheduler
+MAX_SLEEP = 3600
+# delay before a reminder which failed to be fired is tried again
+RETRY_DELAY = datetime.timedelta(minutes=1)
+# number of due reminders loaded per query
+BATCH_SIZE = 500
+
+class ReminderScheduler:
+    def __init__(self, bot: Gunibot) -> None:
+        self.bot = bot
+        self.logger = self.bot.get_logger("reminders.scheduler")
+
+        self._heap: List[Tuple[datetime.datetime, int]] = []
+        self._entries: Dict[int, datetime.datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.dispatcher = ReminderDispatcher(self.bot)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def load(self) -> None:
+        session = self.bot.database.session
+
+        # rows written before the next_fire column existed
+        for reminder in session.query(Reminder).filter(
+            Reminder.next_fire.is_(None),
+            sqlalchemy.or_(
+                Reminder.sended == False,
+                Reminder.scheduled.isnot(None),
+            ),
+        ).all():
+            reminder.update_next_fire()
+        session.commit()
+
+        self._entries = dict(
+            session.query(
+                Reminder.id,
+                Reminder.next_fire,
+            ).filter(
+                Reminder.next_fire.isnot(None),
+            )
+        )
+        self._heap = [(fire, id) for id, fire in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def schedule(self, reminder: Reminder) -> None:
+        if reminder.next_fire is None:
+            self.unschedule(reminder)
+            return
+
+        self._push(reminder.id, reminder.next_fire)
+
+    def schedule_all(self, fires: Iterable[Tuple[int, Optional[datetime.datetime]]]) -> None:
+        # (reminder id, next fire) of reminders inserted without loading them
+        for reminder_id, fire in fires:
+            if fire is not None:
+                self._push(reminder_id, fire)
+
+    def _push(self, reminder_id: int, fire: datetime.datetime) -> None:
+        self._entries[reminder_id] = fire
+        heapq.heappush(self._heap, (fire, reminder_id))
+        if len(self._heap) > 2 * len(self._entries) + 64: # too many stale entries
+            self._heap = [(fire, id) for id, fire in self._entries.items()]
+            heapq.heapify(self._heap)
+        if self._heap[0] == (fire, reminder_id): # the earliest fire changed
+            self._wakeup.set()
+
+    def unschedule(self, reminder: Reminder) -> None:
+        # the heap entry is discarded lazily when it reaches the top
+        self._entries.pop(reminder.id, None)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        with self.bot.database.session_scope():
+            self.load()
+        self.dispatcher.start()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.dispatcher.stop()
+
+    def _pop_due(self, now: datetime.datetime) -> List[int]:
+        due = []
+        while len(self._heap) > 0 and self._heap[0][0] <= now:
+            fire, reminder_id = heapq.heappop(self._heap)
+            if self._entries.get(reminder_id) == fire:
+                del self._entries[reminder_id]
+                due.append(reminder_id)
+        return due
+
+    def _next_delay(self, now: datetime.datetime) -> float:
+        while len(self._heap) > 0:
+            fire, reminder_id = self._heap[0]
+            if self._entries.get(reminder_id) == fire:
+                return min(max((fire - now).total_seconds(), 0), MAX_SLEEP)
+            heapq.heappop(self._heap) # stale entry
+        return MAX_SLEEP
+
+    def _fire(self, reminders: List[Reminder], now: datetime.datetime) -> None:
+        configuration = self.bot.configuration
+        pending = {}
+        for reminder in reminders:
+            count = reminder.pending_fires(
+                now,
+                configuration.reminders_missed_policy,
+                configuration.reminders_missed_cap,
+                datetime.timedelta(seconds=configuration.reminders_missed_grace),
+            )
+            if reminder.notification and count > 0:
+                pending[reminder] = count
+
+        # the deliveries and the advance of the schedules are committed together
+        self.dispatcher.enqueue(pending, now)
+        for reminder in reminders:
+            reminder.advance(now)
+        self.bot.database.session.commit()
+
+        for reminder in reminders:
+            self.schedule(reminder)
+            self.bot.embed_cache.bump(reminder.embed_key)
+        if len(pending) > 0:
+            self.dispatcher.wakeup()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = datetime.datetime.utcnow()
+
+            due = self._pop_due(now)
+            if len(due) > 0:
+                # the edits waiting to be written may change what fires
+                self.bot.write_behind.flush()
+            for index in range(0, len(due), BATCH_SIZE):
+                batch = due[index:index + BATCH_SIZE]
+                try:
+                    with self.bot.database.session_scope() as session:
+                        self._fire(
+                            session.query(
+                                Reminder
+                            ).filter(
+                                Reminder.id.in_(batch),
+                            ).all(),
+                            now,
+                        )
+                except Exception:
+                    self.logger.exception(f"Unable to fire {len(batch)} reminders")
+                    for reminder_id in batch:
+                        self._push(reminder_id, now + RETRY_DELAY)
+
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    timeout=self._next_delay(datetime.datetime.utcnow()),
+                )
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,304 @@
+from __future__ import annotations
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+import contextlib
+import datetime
+import json
+import zoneinfo
+
+import aiohttp
+
+from .reminder import Reminder
+
+# an entry parsed from a file, or the error which made it invalid
+Entry = Union[Dict[str, Any], ValueError]
+
+JSONL = "jsonl"
+ICS = "ics"
+FORMATS = {
+    ".jsonl": JSONL,
+    ".ndjson": JSONL,
+    ".json": JSONL,
+    ".ics": ICS,
+}
+
+# the cron of a reminder, exported as an extension property so it is imported back unchanged
+ICS_CRON = "X-GUNIBOT-CRON"
+ICS_WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+# size of the files accepted by an import
+MAX_IMPORT_SIZE = 5 * 1024 * 1024
+# an export bigger than this is written to the disk instead of the memory
+EXPORT_SPOOL_SIZE = 1024 * 1024
+
+# lines longer than this, in octets, are folded, as required by the RFC 5545
+ICS_LINE_LENGTH = 75
+
+def get_format(filename: str) -> Optional[str]:
+    for extension, format in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return format
+    return None
+
+async def stream_lines(url: str) -> AsyncIterator[str]:
+    # the lines of an attachment as they are downloaded
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url, raise_for_status=True) as response:
+                first = True
+                async for line in response.content:
+                    line = line.decode("utf-8", errors="replace")
+                    if first:
+                        line = line.removeprefix("\ufeff")
+                        first = False
+                    yield line
+    except aiohttp.ClientError as e:
+        raise OSError(f"Unable to download {url}") from e
+    except ValueError as e: # a line too long for the buffer of aiohttp
+        raise OSError(f"Unable to read {url}") from e
+
+def parse_time(value: Union[str, int, float]) -> datetime.datetime:
+    # a unix timestamp or an ISO 8601 date, stored as a naive UTC datetime
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.datetime.utcfromtimestamp(value)
+    if not isinstance(value, str):
+        raise ValueError("La date doit être un timestamp ou une date ISO 8601")
+    try:
+        time = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Date invalide : {value}")
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time
+
+async def parse_jsonl(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Entry]]:
+    # one reminder per line: {"name", "description", "scheduled" or "time", "notification"}
+    number = 0
+    # closed along with the parser, when the import stops early
+    async with contextlib.aclosing(lines):
+        async for line in lines:
+            number += 1
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            try:
+                object = json.loads(line)
+                if not isinstance(object, dict):
+                    raise ValueError("Chaque ligne doit être un objet JSON")
+                entry = {
+                    "name": object.get("name"),
+                    "description": object.get("description"),
+                    "notification": object.get("notification", True),
+                }
+                if object.get("scheduled") is not None:
+                    entry["scheduled"] = object["scheduled"]
+                elif object.get("time") is not None:
+                    entry["time"] = parse_time(object["time"])
+                yield number, entry
+            except json.JSONDecodeError:
+                yield number, ValueError("JSON invalide")
+            except ValueError as e:
+                yield number, e
+
+def unescape_ics(value: str) -> str:
+    result = []
+    escaped = False
+    for character in value:
+        if escaped:
+            result.append("\n" if character in "nN" else character)
+            escaped = False
+        elif character == "\\":
+            escaped = True
+        else:
+            result.append(character)
+    return "".join(result)
+
+def escape_ics(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def parse_ics_time(value: str, parameters: Dict[str, str]) -> datetime.datetime:
+    try:
+        if parameters.get("VALUE") == "DATE" or len(value) == 8:
+            return datetime.datetime.strptime(value, "%Y%m%d")
+        if value.endswith("Z"):
+            return datetime.datetime.strptime(value, "%Y%m%dT%H%M%SZ")
+        time = datetime.datetime.strptime(value, "%Y%m%dT%H%M%S")
+    except ValueError:
+        raise ValueError(f"Date invalide : {value}")
+    if "TZID" in parameters:
+        try:
+            zone = zoneinfo.ZoneInfo(parameters["TZID"])
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Fuseau horaire inconnu : {parameters['TZID']}")
+        time = time.replace(tzinfo=zone).astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    # floating times are taken as UTC
+    return time
+
+def rrule_to_cron(rule: str, start: datetime.datetime) -> str:
+    # only the rules which have a cron equivalent
+    parts = dict(part.split("=", 1) for part in rule.split(";") if "=" in part)
+    frequency = parts.pop("FREQ", None)
+    parts.pop("WKST", None)
+    if parts.pop("INTERVAL", "1") != "1" or len(set(parts) - {"BYDAY", "BYMONTHDAY"}) > 0:
+        raise ValueError(f"Règle de récurrence non supportée : {rule}")
+    if frequency == "HOURLY" and len(parts) == 0:
+        return f"{start.minute} * * * *"
+    elif frequency == "DAILY" and len(parts) == 0:
+        return f"{start.minute} {start.hour} * * *"
+    elif frequency == "WEEKLY" and "BYMONTHDAY" not in parts:
+        days = parts.get("BYDAY", ICS_WEEKDAYS[start.weekday()]).split(",")
+        if any(day not in ICS_WEEKDAYS for day in days):
+            raise ValueError(f"Règle de récurrence non supportée : {rule}")
+        # cron counts the days from sunday
+        return f"{start.minute} {start.hour} * * {','.join(str((ICS_WEEKDAYS.index(day) + 1) % 7) for day in days)}"
+    elif frequency == "MONTHLY" and "BYDAY" not in parts:
+        return f"{start.minute} {start.hour} {parts.get('BYMONTHDAY', start.day)} * *"
+    elif frequency == "YEARLY" and len(parts) == 0:
+        return f"{start.minute} {start.hour} {start.day} {start.month} *"
+    raise ValueError(f"Règle de récurrence non supportée : {rule}")
+
+def parse_ics_event(properties: List[Tuple[str, Dict[str, str], str]]) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {"name": None, "description": None, "notification": True}
+    start = None
+    rule = None
+    cron = None
+    for name, parameters, value in properties:
+        if name == "SUMMARY":
+            entry["name"] = unescape_ics(value)
+        elif name == "DESCRIPTION":
+            entry["description"] = unescape_ics(value)
+        elif name == "DTSTART":
+            start = parse_ics_time(value, parameters)
+        elif name == "RRULE":
+            rule = value
+        elif name == ICS_CRON:
+            cron = value
+    if cron is not None:
+        entry["scheduled"] = cron
+    elif rule is not None:
+        if start is None:
+            raise ValueError("Une récurrence nécessite un DTSTART")
+        entry["scheduled"] = rrule_to_cron(rule, start)
+    elif start is not None:
+        entry["time"] = start
+    return entry
+
+def parse_ics_line(line: str) -> Tuple[str, Dict[str, str], str]:
+    head, _, value = line.partition(":")
+    name, *parameters = head.split(";")
+    return (
+        name.upper(),
+        {
+            key.upper(): parameter.strip('"')
+            for key, _, parameter in (parameter.partition("=") for parameter in parameters)
+        },
+        value,
+    )
+
+async def parse_ics(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Entry]]:
+    # the events of a calendar, the other components are ignored
+    event: Optional[List[Tuple[str, Dict[str, str], str]]] = None
+    event_number = 0
+    depth = 0 # the components nested in an event, like its alarms
+
+    async def unfold() -> AsyncIterator[Tuple[int, str]]:
+        # the folded lines, with the number of their first line
+        number = 0
+        logical = None
+        start = 0
+        async with contextlib.aclosing(lines):
+            async for line in lines:
+                number += 1
+                line = line.rstrip("\r\n")
+                if line.startswith((" ", "\t")) and logical is not None:
+                    logical += line[1:]
+                    continue
+                if logical is not None:
+                    yield start, logical
+                logical = line
+                start = number
+            if logical is not None:
+                yield start, logical
+
+    async with contextlib.aclosing(unfold()) as folded:
+        async for line_number, line in folded:
+            if len(line) == 0:
+                continue
+            name, parameters, value = parse_ics_line(line)
+            if name == "BEGIN":
+                if event is not None:
+                    depth += 1
+                elif value.upper() == "VEVENT":
+                    event = []
+                    event_number = line_number
+            elif name == "END":
+                if event is not None and depth > 0:
+                    depth -= 1
+                elif event is not None and value.upper() == "VEVENT":
+                    try:
+                        yield event_number, parse_ics_event(event)
+                    except ValueError as e:
+                        yield event_number, e
+                    event = None
+            elif event is not None and depth == 0:
+                event.append((name, parameters, value))
+
+def format_ics_time(time: datetime.datetime) -> str:
+    return time.strftime("%Y%m%dT%H%M%SZ")
+
+def fold_ics(line: str) -> str:
+    # the continuation lines start with a space, a multi-byte character is never split
+    if len(line.encode("utf-8")) <= ICS_LINE_LENGTH:
+        return line + "\r\n"
+    chunks = []
+    chunk = ""
+    size = 0
+    for character in line:
+        length = len(character.encode("utf-8"))
+        if size + length > ICS_LINE_LENGTH:
+            chunks.append(chunk)
+            chunk = " "
+            size = 1
+        chunk += character
+        size += length
+    chunks.append(chunk)
+    return "\r\n".join(chunks) + "\r\n"
+
+def to_jsonl(reminder: Reminder) -> str:
+    object: Dict[str, Any] = {
+        "name": reminder.name,
+        "description": reminder.description,
+        "notification": reminder.notification,
+    }
+    if reminder.scheduled is not None:
+        object["scheduled"] = reminder.scheduled
+    elif reminder.time is not None:
+        object["time"] = reminder.time.isoformat() + "Z"
+    return json.dumps(object, ensure_ascii=False) + "\n"
+
+ICS_HEADER = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Gunibot//Reminders//FR\r\n"
+ICS_FOOTER = "END:VCALENDAR\r\n"
+
+def to_ics(reminder: Reminder) -> str:
+    start = reminder.next_fire or reminder.time or datetime.datetime.utcnow()
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:reminder-{reminder.id}@gunibot",
+        f"DTSTAMP:{format_ics_time(datetime.datetime.utcnow())}",
+        f"DTSTART:{format_ics_time(start)}",
+        f"SUMMARY:{escape_ics(reminder.name or '')}",
+    ]
+    if reminder.description:
+        lines.append(f"DESCRIPTION:{escape_ics(reminder.description)}")
+    if reminder.scheduled is not None:
+        lines.append(f"{ICS_CRON}:{reminder.scheduled}")
+    lines.append("END:VEVENT")
+    return "".join(fold_ics(line) for line in lines)
+
+PARSERS = {
+    JSONL: parse_jsonl,
+    ICS: parse_ics,
+}
+SERIALIZERS = {
+    JSONL: (to_jsonl, "", ""),
+    ICS: (to_ics, ICS_HEADER, ICS_FOOTER),
+}
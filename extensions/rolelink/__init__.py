@@ -1,16 +1,40 @@
+from typing import Optional
+
 import nextcord
 from nextcord.ext import commands
 
 import gunibot
 
-from .hub import HubManager, Hub
+from .hub import AUTOCOMPLETE_KEY, HubManager, build_page_embed, build_search_embed, decode_search_cursor, get_page_view, get_search_view
+from .migrations import MIGRATIONS
+from .rolelink import Rolelink as RolelinkModel, RolelinkManager
+from .sync import RoleSync
 
 class Rolelink(commands.Cog):
     def __init__(self, bot: gunibot.Gunibot):
         self.bot = bot
         self.bot.configuration.add_guilds(self.hub)
+        self.bot.configuration.add_guilds(self.rolelink)
         
         self.hub_manager = HubManager(self.bot)
+        self.rolelink_manager = RolelinkManager(self.bot)
+        self.role_sync = RoleSync(self.bot)
+        self.bot.add_migrations(__package__, MIGRATIONS)
+        
+        self.bot.router.add("hub", "delete", self.delete_button)
+        self.bot.router.add("hub", "edit", self.edit_button)
+        self.bot.router.add("hub", "previous", self.previous_button)
+        self.bot.router.add("hub", "next", self.next_button)
+        self.bot.router.add("hub_search", "previous", self.search_previous_button)
+        self.bot.router.add("hub_search", "next", self.search_next_button)
+        # the buttons of the hubs sent before the router
+        self.bot.router.add_legacy("persistent:hub:delete:", "hub", "delete")
+        self.bot.router.add_legacy("persistent:hub:edit:", "hub", "edit")
+    
+    def cog_unload(self):
+        self.bot.router.remove("hub")
+        self.bot.router.remove("hub_search")
+        self.role_sync.stop()
     
     @nextcord.slash_command(
         name="hub",
@@ -23,6 +47,7 @@ class Rolelink(commands.Cog):
         name="create",
         description="Permet de créer un hub de serveurs.",
     )
+    @gunibot.unit_of_work
     async def hub_create(
         self,
         inter: nextcord.Interaction,
@@ -35,7 +60,7 @@ class Rolelink(commands.Cog):
             required=False,
         )
     ):
-        hub = self.hub_manager.create_hub(name, inter.user, description)
+        hub = await self.hub_manager.create_hub_async(name, inter.user, description)
         await inter.send(
             "Le hub a bien été créé !",
             embed=await hub.get_embed(self.bot),
@@ -46,6 +71,7 @@ class Rolelink(commands.Cog):
         name="show",
         description="Affiche un hub."
     )
+    @gunibot.unit_of_work
     async def hub_show(
         self,
         inter: nextcord.Interaction,
@@ -56,7 +82,7 @@ class Rolelink(commands.Cog):
             required=True,
         ),
     ) -> None:
-        hub = self.hub_manager.get_hub_by_name(hub_name)
+        hub = await self.hub_manager.get_hub_by_name_async(hub_name)
         if hub is None:
             if hub_name == gunibot.EMPTY_AUTOCOMPLETE:
                 await inter.send(
@@ -75,46 +101,418 @@ class Rolelink(commands.Cog):
             ephemeral=True,
         )
     
+    @hub.subcommand(
+        name="list",
+        description="Affiche la liste des hubs que tu administres.",
+    )
+    @gunibot.unit_of_work
+    async def hub_list(self, inter: nextcord.Interaction) -> None:
+        page = await self.hub_manager.get_page_async(inter.user)
+        if len(page.items) == 0:
+            await inter.send(
+                "Tu n'administres aucun hub. Utilise `/hub create` pour en créer un !",
+                ephemeral=True,
+            )
+            return
+        await inter.send(
+            embed=build_page_embed(page),
+            view=get_page_view(page),
+            ephemeral=True,
+        )
+
+    @hub.subcommand(
+        name="search",
+        description="Recherche des hubs par leur nom ou leur description.",
+    )
+    @gunibot.unit_of_work
+    async def hub_search(
+        self,
+        inter: nextcord.Interaction,
+        query: str = nextcord.SlashOption(
+            name="recherche",
+            description="Les mots à chercher dans le nom et la description des hubs.",
+            required=True,
+            max_length=50,
+        ),
+    ) -> None:
+        page = await self.hub_manager.search_hubs_async(query)
+        if len(page.items) == 0:
+            await inter.send(
+                "Je n'ai trouvé aucun hub correspondant à ta recherche.",
+                ephemeral=True,
+            )
+            return
+        await inter.send(
+            embed=build_search_embed(page, query),
+            view=get_search_view(page, query),
+            ephemeral=True,
+        )
+
+    @nextcord.slash_command(
+        name="rolelink",
+        guild_ids=[],
+    )
+    async def rolelink(self, inter: nextcord.Interaction):
+        pass
+
+    async def get_admin_rolelink(
+        self,
+        inter: nextcord.Interaction,
+        hub_name: str,
+        name: str,
+    ) -> Optional[RolelinkModel]:
+        # the rolelink, if the user administers its hub
+        hub = self.hub_manager.get_hub_by_name(hub_name, inter.user)
+        if hub is None:
+            await inter.send("Tu n'administres aucun hub avec ce nom.", ephemeral=True)
+            return None
+        rolelink = self.rolelink_manager.get_rolelink_by_name(hub, name)
+        if rolelink is None:
+            await inter.send(f"Le hub {hub.name} n'a pas de lien de rôles nommé {name}.", ephemeral=True)
+            return None
+        return rolelink
+
+    async def check_role(self, inter: nextcord.Interaction, role: nextcord.Role) -> bool:
+        # the role is given by the user in its guild, and the bot must be able to manage it
+        if inter.guild is None or role.guild.id != inter.guild.id:
+            await inter.send("Le rôle doit appartenir au serveur sur lequel la commande est utilisée.", ephemeral=True)
+            return False
+        if not inter.user.guild_permissions.manage_roles:
+            await inter.send("Tu dois avoir la permission de gérer les rôles sur ce serveur.", ephemeral=True)
+            return False
+        if role.is_default() or role.managed or role >= inter.guild.me.top_role:
+            await inter.send("Je ne peux pas attribuer ce rôle.", ephemeral=True)
+            return False
+        return True
+
+    @rolelink.subcommand(
+        name="create",
+        description="Crée un lien de rôles entre les serveurs d'un hub.",
+    )
+    @gunibot.unit_of_work
+    async def rolelink_create(
+        self,
+        inter: nextcord.Interaction,
+        hub_name: str = nextcord.SlashOption(
+            name="hub",
+            description="Le hub dont les serveurs partageront le rôle.",
+            autocomplete=True,
+            required=True,
+        ),
+        name: str = nextcord.SlashOption(
+            name="nom",
+            description="Le nom du lien de rôles.",
+            required=True,
+            max_length=100,
+        ),
+    ) -> None:
+        hub = self.hub_manager.get_hub_by_name(hub_name, inter.user)
+        if hub is None:
+            await inter.send("Tu n'administres aucun hub avec ce nom.", ephemeral=True)
+            return
+        try:
+            self.rolelink_manager.create_rolelink(hub, name)
+        except ValueError:
+            await inter.send(f"Le hub {hub.name} a déjà un lien de rôles nommé {name}.", ephemeral=True)
+            return
+        await inter.send(
+            f"Le lien de rôles {name} a bien été créé ! Utilise `/rolelink add` sur chaque serveur pour y ajouter un rôle.",
+            ephemeral=True,
+        )
+
+    @rolelink.subcommand(
+        name="delete",
+        description="Supprime un lien de rôles.",
+    )
+    @gunibot.unit_of_work
+    async def rolelink_delete(
+        self,
+        inter: nextcord.Interaction,
+        hub_name: str = nextcord.SlashOption(
+            name="hub",
+            description="Le hub du lien de rôles.",
+            autocomplete=True,
+            required=True,
+        ),
+        name: str = nextcord.SlashOption(
+            name="nom",
+            description="Le nom du lien de rôles.",
+            required=True,
+        ),
+    ) -> None:
+        rolelink = await self.get_admin_rolelink(inter, hub_name, name)
+        if rolelink is None:
+            return
+        self.rolelink_manager.delete_rolelink(rolelink)
+        await inter.send(f"Le lien de rôles {name} a bien été supprimé.", ephemeral=True)
+
+    @rolelink.subcommand(
+        name="add",
+        description="Lie un rôle de ce serveur aux rôles des autres serveurs du hub.",
+    )
+    @gunibot.unit_of_work
+    async def rolelink_add(
+        self,
+        inter: nextcord.Interaction,
+        hub_name: str = nextcord.SlashOption(
+            name="hub",
+            description="Le hub du lien de rôles.",
+            autocomplete=True,
+            required=True,
+        ),
+        name: str = nextcord.SlashOption(
+            name="nom",
+            description="Le nom du lien de rôles.",
+            required=True,
+        ),
+        role: nextcord.Role = nextcord.SlashOption(
+            name="role",
+            description="Le rôle de ce serveur à lier.",
+            required=True,
+        ),
+    ) -> None:
+        if not await self.check_role(inter, role):
+            return
+        rolelink = await self.get_admin_rolelink(inter, hub_name, name)
+        if rolelink is None:
+            return
+        try:
+            self.rolelink_manager.add_role(rolelink, role)
+        except ValueError:
+            await inter.send(
+                "Ce rôle est déjà lié, ou ce lien a déjà un rôle sur ce serveur.",
+                ephemeral=True,
+            )
+            return
+        guild_roles = dict(rolelink.guild_roles)
+        await inter.response.defer(ephemeral=True)
+        # the members who have the role in another guild receive it here, and the other way around
+        queued = await self.role_sync.reconcile(guild_roles)
+        await inter.send(
+            f"Le rôle {role.mention} a bien été lié ! {queued} attribution(s) de rôle en attente.",
+            ephemeral=True,
+        )
+
+    @rolelink.subcommand(
+        name="remove",
+        description="Retire un rôle de ce serveur d'un lien de rôles.",
+    )
+    @gunibot.unit_of_work
+    async def rolelink_remove(
+        self,
+        inter: nextcord.Interaction,
+        hub_name: str = nextcord.SlashOption(
+            name="hub",
+            description="Le hub du lien de rôles.",
+            autocomplete=True,
+            required=True,
+        ),
+        name: str = nextcord.SlashOption(
+            name="nom",
+            description="Le nom du lien de rôles.",
+            required=True,
+        ),
+        role: nextcord.Role = nextcord.SlashOption(
+            name="role",
+            description="Le rôle de ce serveur à retirer.",
+            required=True,
+        ),
+    ) -> None:
+        if inter.guild is None or role.guild.id != inter.guild.id or not inter.user.guild_permissions.manage_roles:
+            await inter.send("Tu dois avoir la permission de gérer les rôles sur ce serveur.", ephemeral=True)
+            return
+        rolelink = await self.get_admin_rolelink(inter, hub_name, name)
+        if rolelink is None:
+            return
+        self.rolelink_manager.remove_role(rolelink, role)
+        await inter.send(f"Le rôle {role.mention} n'est plus lié.", ephemeral=True)
+
+    @rolelink.subcommand(
+        name="sync",
+        description="Aligne les rôles liés des autres serveurs du hub sur ceux de ce serveur.",
+    )
+    @gunibot.unit_of_work
+    async def rolelink_sync(
+        self,
+        inter: nextcord.Interaction,
+        hub_name: str = nextcord.SlashOption(
+            name="hub",
+            description="Le hub du lien de rôles.",
+            autocomplete=True,
+            required=True,
+        ),
+        name: str = nextcord.SlashOption(
+            name="nom",
+            description="Le nom du lien de rôles.",
+            required=True,
+        ),
+    ) -> None:
+        rolelink = await self.get_admin_rolelink(inter, hub_name, name)
+        if rolelink is None:
+            return
+        guild_roles = dict(rolelink.guild_roles)
+        if inter.guild is None or inter.guild.id not in guild_roles:
+            await inter.send(
+                "Ce serveur n'a pas de rôle dans ce lien, il ne peut pas servir de référence.",
+                ephemeral=True,
+            )
+            return
+        await inter.response.defer(ephemeral=True)
+        # the holders of the role in this guild are the reference, the roles are added or removed elsewhere
+        queued = await self.role_sync.reconcile(guild_roles, inter.guild.id)
+        await inter.send(f"{queued} modification(s) de rôle en attente.", ephemeral=True)
+
+    @rolelink_sync.on_autocomplete('hub_name')
+    @rolelink_remove.on_autocomplete('hub_name')
+    @rolelink_add.on_autocomplete('hub_name')
+    @rolelink_delete.on_autocomplete('hub_name')
+    @rolelink_create.on_autocomplete('hub_name')
     @hub_show.on_autocomplete('hub_name')
+    @gunibot.unit_of_work
     async def hub_autocomplete(
         self,
         inter: nextcord.Interaction,
         focused_value: str,
     ) -> None:
-        hub_names = [hub.name for hub in self.hub_manager.get_hubs(inter.user, focused_value)]
+        hub_names = await self.bot.autocomplete_cache.complete(
+            (inter.user.id, AUTOCOMPLETE_KEY),
+            focused_value,
+            lambda prefix, limit: self.hub_manager.complete_names_async(
+                inter.user,
+                prefix,
+                limit,
+            ),
+        )
+        if hub_names is None: # superseded by a newer keystroke
+            return None
         if len(hub_names) == 0:
             return [gunibot.EMPTY_AUTOCOMPLETE]
         return hub_names
 
     @commands.Cog.listener()
-    async def on_interaction(self, inter: nextcord.Interaction):
-        if inter.type == nextcord.InteractionType.component:
-            custom_id = inter.data['custom_id']
-            
-            if not custom_id.startswith('persistent:hub:'):
+    async def on_member_update(self, before: nextcord.Member, after: nextcord.Member) -> None:
+        # needs the members intent
+        index = self.rolelink_manager.index
+        if index.ready:
+            # most guilds have no linked role
+            linked = index.get_guild(after.guild.id)
+            if linked is None:
+                return
+            changed = {role.id for role in before.roles} ^ {role.id for role in after.roles}
+            links = {
+                role: index.get_guild_roles(linked[role])
+                for role in changed
+                if role in linked
+            }
+        else:
+            # the index is still cold
+            changed = {role.id for role in before.roles} ^ {role.id for role in after.roles}
+            if len(changed) == 0:
                 return
-            
-            custom_id = custom_id[15:]
-            hub = self.hub_manager.get_hub(custom_id.split(':')[-1])
+            with self.bot.database.session_scope():
+                links = {
+                    role: rolelink.guild_roles
+                    for role, rolelink in self.rolelink_manager.get_links(after.guild.id, changed).items()
+                }
+        for role, guild_roles in links.items():
+            self.role_sync.propagate(
+                after.id,
+                guild_roles,
+                after.get_role(role) is not None,
+                after.guild.id,
+            )
 
-            if custom_id.startswith('delete'):
-                self.hub_manager.delete_hub(hub)
+    @commands.Cog.listener()
+    async def on_ready(self) -> None:
+        if not self.hub_manager.name_index.ready:
+            with self.bot.database.session_scope():
+                self.hub_manager.warm_index()
+        if not self.rolelink_manager.index.ready:
+            with self.bot.database.session_scope():
+                self.rolelink_manager.warm_index()
 
-                view = hub.get_view()
+    @gunibot.unit_of_work
+    async def delete_button(self, inter: nextcord.Interaction, hub_id: str):
+        hub = self.hub_manager.get_hub(hub_id)
+        if hub is None:
+            await inter.send("Ce hub a déjà été supprimé.", ephemeral=True)
+            return
 
-                for item in view.children: # disable all buttons
-                    if isinstance(item, nextcord.ui.Button):
-                        item.disabled = True
+        if not hub.is_admin(inter.user):
+            await inter.send(
+                "Vous n'avez pas l'autorisation de supprimer ce hub.",
+                ephemeral=True,
+            )
+            return
 
-                await inter.response.edit_message(
-                    embed=await hub.get_embed(self.bot),
-                    view=view,
-                )
+        self.hub_manager.delete_hub(hub)
+        # its rolelinks are deleted with it
+        self.rolelink_manager.index.remove_hub(hub.id)
 
-            elif custom_id.startswith('edit'):
-                await inter.response.send_modal(
-                    hub.get_modal(),
-                )
+        await inter.response.edit_message(
+            # built once, a deleted hub has nothing to cache
+            embed=await hub.build_embed(self.bot),
+            view=hub.get_view(disabled=True),
+        )
+
+    @gunibot.unit_of_work
+    async def edit_button(self, inter: nextcord.Interaction, hub_id: str):
+        hub = self.hub_manager.get_hub(hub_id)
+        if hub is None:
+            await inter.send("Ce hub a été supprimé.", ephemeral=True)
+            return
+        await inter.response.send_modal(
+            hub.get_modal(self.hub_manager),
+        )
+
+    async def show_page(self, inter: nextcord.Interaction, cursor: str, backwards: bool) -> None:
+        page = await self.hub_manager.get_page_async(inter.user, gunibot.decode_id(cursor), backwards)
+        if len(page.items) == 0: # the hubs of the page were deleted meanwhile
+            page = await self.hub_manager.get_page_async(inter.user)
+        if len(page.items) == 0:
+            await inter.response.edit_message(
+                content="Tu n'administres plus aucun hub.",
+                embed=None,
+                view=None,
+            )
+            return
+        await inter.response.edit_message(
+            embed=build_page_embed(page),
+            view=get_page_view(page),
+        )
+
+    @gunibot.unit_of_work
+    async def previous_button(self, inter: nextcord.Interaction, cursor: str) -> None:
+        await self.show_page(inter, cursor, backwards=True)
+
+    @gunibot.unit_of_work
+    async def next_button(self, inter: nextcord.Interaction, cursor: str) -> None:
+        await self.show_page(inter, cursor, backwards=False)
+
+    async def show_search(self, inter: nextcord.Interaction, rank: str, hub_id: str, query: str, backwards: bool) -> None:
+        page = await self.hub_manager.search_hubs_async(query, decode_search_cursor(rank, hub_id), backwards)
+        if len(page.items) == 0: # the hubs of the page were deleted or changed meanwhile
+            page = await self.hub_manager.search_hubs_async(query)
+        if len(page.items) == 0:
+            await inter.response.edit_message(
+                content="Plus aucun hub ne correspond à ta recherche.",
+                embed=None,
+                view=None,
+            )
+            return
+        await inter.response.edit_message(
+            embed=build_search_embed(page, query),
+            view=get_search_view(page, query),
+        )
+
+    # the query may contain ":", the router splits it in several arguments
+    @gunibot.unit_of_work
+    async def search_previous_button(self, inter: nextcord.Interaction, rank: str, hub_id: str, *query: str) -> None:
+        await self.show_search(inter, rank, hub_id, ":".join(query), backwards=True)
+
+    @gunibot.unit_of_work
+    async def search_next_button(self, inter: nextcord.Interaction, rank: str, hub_id: str, *query: str) -> None:
+        await self.show_search(inter, rank, hub_id, ":".join(query), backwards=False)
 
 def setup(bot: gunibot.Gunibot):
     bot.add_cog(Rolelink(bot))
\ No newline at end of file
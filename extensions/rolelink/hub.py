@@ -1,16 +1,59 @@
 from __future__ import annotations
-from typing import Iterable, List, Optional, Union
+from typing import Iterable, List, Optional, Tuple, Union
 
+import asyncio
 import base64
+import struct
 
 import sqlalchemy
 import nextcord
 
-from gunibot import Base, Gunibot, EMPTY_AUTOCOMPLETE
+from gunibot import PAGE_SIZE, Base, Gunibot, ComponentRouter, ComponentTemplate, EMPTY_AUTOCOMPLETE, Page, PageTemplate, PrefixIndex, RenderedComponents, decode_id, encode_id, unit_of_work
+
+from .rolelink import Rolelink
+
+# the key of the autocompletion of the hub names, with the user id
+AUTOCOMPLETE_KEY = "hub"
+
+# the buttons of the pages of /hub list
+HUB_PAGES = PageTemplate("hub")
+
+# full-text index of the names and descriptions of the hubs, sqlite only
+HUB_SEARCH_TABLE = "rolelink_hubs_fts"
+HUB_SEARCH = sqlalchemy.table(
+    HUB_SEARCH_TABLE,
+    sqlalchemy.column("rowid"),
+    sqlalchemy.column("rank"),
+)
+# results shown by a page of a search
+SEARCH_LIMIT = 10
+# the buttons of the pages of /hub search, the query is kept in their custom ids
+SEARCH_PAGES = PageTemplate("hub_search")
+
+# admins resolved at the same time when rendering a hub
+ADMINS_CONCURRENCY = 10
+# seconds after which the admins not resolved yet are mentioned by their ID
+ADMINS_DEADLINE = 2
+
+HUB_COMPONENTS = ComponentTemplate([
+    nextcord.ui.Button(
+        custom_id=ComponentRouter.custom_id("hub", "delete", "{}"),
+        style=nextcord.ButtonStyle.danger,
+        label="Supprimer le hub",
+        emoji="🗑",
+    ),
+    nextcord.ui.Button(
+        custom_id=ComponentRouter.custom_id("hub", "edit", "{}"),
+        style=nextcord.ButtonStyle.secondary,
+        label="Modifier le hub",
+        emoji="✏",
+    ),
+])
 
 class HubModal(nextcord.ui.Modal):
-    def __init__(self, hub: Hub):
+    def __init__(self, hub: Hub, manager: HubManager):
         self.hub = hub
+        self.manager = manager
         super().__init__(
             "Modifier un hub de serveurs"
         )
@@ -30,15 +73,30 @@ class HubModal(nextcord.ui.Modal):
         self.add_item(self.name)
         self.add_item(self.description)
     
+    @unit_of_work
     async def callback(self, inter: nextcord.Interaction):
+        # the hub was loaded by the session of another interaction
+        self.hub = inter.client.write_behind.overlay(
+            inter.client.database.session.get(Hub, self.hub.id),
+        )
+        if self.hub is None:
+            await inter.send(
+                "Ce hub a été supprimé entre temps.",
+                ephemeral=True,
+            )
+            return
         if not self.hub.is_admin(inter.user):
             await inter.send(
                 "Vous n'avez pas l'autorisation d'effectuer des modifications sur ce hub.",
                 ephemeral=True,
             )
             return
-        self.hub.name = self.name.value
-        self.hub.description = self.description.value
+        self.manager.edit_hub(
+            self.hub,
+            self.name.value,
+            self.description.value,
+        )
+        inter.client.write_behind.stage(self.hub)
         
         try:
             await inter.response.edit_message(
@@ -55,6 +113,9 @@ class HubModal(nextcord.ui.Modal):
 
 class Hub(Base):
     __tablename__="rolelink_hubs"
+    __table_args__ = (
+        sqlalchemy.Index("ix_rolelink_hubs_name", "name"),
+    )
     
     id: int = sqlalchemy.Column(
         sqlalchemy.Integer,
@@ -64,10 +125,12 @@ class Hub(Base):
     name: str = sqlalchemy.Column(sqlalchemy.String)
     description: str = sqlalchemy.Column(sqlalchemy.String, nullable=True)
     admins: Iterable[Admin] = sqlalchemy.orm.relationship("Admin", back_populates="hub")
+    # deleted with the hub, so they stop synchronizing roles
+    rolelinks: Iterable[Rolelink] = sqlalchemy.orm.relationship("Rolelink", back_populates="hub", cascade="all, delete-orphan")
     
     @property
     def encoded_id(self) -> str:
-        return base64.b64encode(self.id.to_bytes(4, byteorder='little')).decode('utf-8')
+        return encode_id(self.id)
     
     def add_admin(
         self,
@@ -78,20 +141,37 @@ class Hub(Base):
             user = user.id
         admin = Admin(hub_id=self.id, user=user)
         bot.database.session.add(admin)
+        bot.embed_cache.bump(self.embed_key)
+        bot.autocomplete_cache.invalidate((user, AUTOCOMPLETE_KEY))
         
         return admin
 
+    @property
+    def summary(self) -> str:
+        # the description shown in the lists of hubs
+        if not self.description:
+            return "Pas de description."
+        if len(self.description) > 200:
+            return self.description[:199] + "…"
+        return self.description
+
+    @property
+    def embed_key(self) -> Tuple[str, int]:
+        return ("hub", self.id)
+
     async def get_embed(self, bot: Gunibot) -> nextcord.Embed:
+        return await bot.embed_cache.get(self.embed_key, lambda: self.build_embed(bot))
+
+    async def build_embed(self, bot: Gunibot) -> nextcord.Embed:
         embed = nextcord.Embed(
             title=f"Hub de serveurs {self.name}",
             colour=0xF76000,
             description=self.description if self.description is not None else '',
         )
         admins = ""
-        for admin in self.admins:
-            user = await admin.get_user(bot)
-            if len(admins) + len(user.mention) < 1023:
-                admins += user.mention + "\n"
+        for mention in await self.get_admin_mentions(bot):
+            if len(admins) + len(mention) < 1023:
+                admins += mention + "\n"
             else:
                 admins += "…"
                 break
@@ -103,31 +183,33 @@ class Hub(Base):
         
         return embed
 
-    def get_view(self) -> nextcord.ui.View:
-        view = nextcord.ui.View(timeout=0)
+    async def get_admin_mentions(self, bot: Gunibot) -> List[str]:
+        admins = list(self.admins)
+        semaphore = asyncio.Semaphore(ADMINS_CONCURRENCY)
         
-        view.add_item(
-            nextcord.ui.Button(
-                custom_id=f"persistent:hub:delete:{self.encoded_id}",
-                style=nextcord.ButtonStyle.danger,
-                label="Supprimer le hub",
-                emoji="🗑",
-            )
-        )
+        async def resolve(admin: Admin) -> Optional[nextcord.User]:
+            async with semaphore:
+                return await admin.get_user(bot)
         
-        view.add_item(
-            nextcord.ui.Button(
-                custom_id=f"persistent:hub:edit:{self.encoded_id}",
-                style=nextcord.ButtonStyle.secondary,
-                label="Modifier le hub",
-                emoji="✏",
-            )
-        )
+        tasks = [asyncio.ensure_future(resolve(admin)) for admin in admins]
+        if len(tasks) > 0:
+            await asyncio.wait(tasks, timeout=ADMINS_DEADLINE)
         
-        return view
+        mentions = []
+        for admin, task in zip(admins, tasks):
+            user = None
+            if not task.done():
+                task.cancel() # too slow, the mention doesn't need the user anyway
+            elif not task.cancelled() and task.exception() is None:
+                user = task.result()
+            mentions.append(user.mention if user is not None else f"<@{admin.user}>")
+        return mentions
+
+    def get_view(self, disabled: bool = False) -> RenderedComponents:
+        return HUB_COMPONENTS.render(self.encoded_id, disabled=disabled)
 
-    def get_modal(self):
-        return HubModal(self)
+    def get_modal(self, manager: HubManager):
+        return HubModal(self, manager)
     
     def is_admin(self, user: nextcord.User):
         for admin in self.admins:
@@ -137,6 +219,11 @@ class Hub(Base):
 
 class Admin(Base):
     __tablename__="rolelink_hub_admins"
+    __table_args__ = (
+        # a user is an admin of a hub only once
+        sqlalchemy.Index("ix_rolelink_hub_admins_user_hub", "user", "hub_id", unique=True),
+        sqlalchemy.Index("ix_rolelink_hub_admins_hub", "hub_id"),
+    )
     
     id: int = sqlalchemy.Column(
         sqlalchemy.Integer,
@@ -148,9 +235,58 @@ class Admin(Base):
     
     hub: Hub = sqlalchemy.orm.relationship("Hub", back_populates="admins")
     
-    async def get_user(self, bot: Gunibot) -> nextcord.User:
+    async def get_user(self, bot: Gunibot) -> Optional[nextcord.User]:
         return await bot.get_or_fetch_user(self.user)
 
+def build_page_embed(page: Page[Hub]) -> nextcord.Embed:
+    embed = nextcord.Embed(
+        title="Tes hubs de serveurs",
+        colour=0xF76000,
+    )
+    for hub in page.items:
+        embed.add_field(
+            name=hub.name,
+            value=hub.summary,
+            inline=False,
+        )
+    return embed
+
+def get_page_view(page: Page[Hub]) -> RenderedComponents:
+    return HUB_PAGES.render(page, page.items[0].id, page.items[-1].id)
+
+def encode_search_cursor(rank: float, id: int, query: str) -> str:
+    # the rank as the 8 bytes of a double, so the custom id fits in 100 characters,
+    # and the query last since it may contain ":"
+    rank = base64.urlsafe_b64encode(struct.pack("<d", rank)).decode("ascii").rstrip("=")
+    return f"{rank}:{encode_id(id)}:{query}"
+
+def decode_search_cursor(rank: str, id: str) -> Tuple[float, int]:
+    try:
+        return struct.unpack("<d", base64.urlsafe_b64decode(rank + "=" * (-len(rank) % 4)))[0], decode_id(id)
+    except (ValueError, struct.error):
+        raise ValueError(f"Invalid search cursor {rank}:{id}")
+
+def build_search_embed(page: Page[Tuple[Hub, float]], query: str) -> nextcord.Embed:
+    embed = nextcord.Embed(
+        title=f"Recherche de hubs : {query}",
+        colour=0xF76000,
+    )
+    for hub, _ in page.items:
+        embed.add_field(
+            name=hub.name,
+            value=hub.summary,
+            inline=False,
+        )
+    return embed
+
+def get_search_view(page: Page[Tuple[Hub, float]], query: str) -> RenderedComponents:
+    (first, first_rank), (last, last_rank) = page.items[0], page.items[-1]
+    return SEARCH_PAGES.render(
+        page,
+        encode_search_cursor(first_rank, first.id, query),
+        encode_search_cursor(last_rank, last.id, query),
+    )
+
 class HubManager:
     def __init__(
         self,
@@ -158,6 +294,8 @@ class HubManager:
     ) -> None:
         self.bot = bot
         
+        self.name_index = PrefixIndex()
+        
         self.bot.add_orm(Hub)
         self.bot.add_orm(Admin)
     
@@ -172,73 +310,377 @@ class HubManager:
         self.bot.database.session.add(hub)
         self.bot.database.session.commit()
         
-        hub.add_admin(self.bot, author)
+        admin = hub.add_admin(self.bot, author)
         self.bot.database.session.commit()
+        self.name_index.add(admin.user, hub.name)
+        self.names_changed(admin.user)
         
         return hub
     
+    async def create_hub_async(
+        self,
+        name: str,
+        author: Union[int, nextcord.Member, nextcord.User],
+        description: str = None,
+    ) -> Hub:
+        if not self.bot.database.is_async:
+            return self.create_hub(name, author, description)
+        if isinstance(author, (nextcord.Member, nextcord.User)):
+            author = author.id
+        
+        hub = Hub(name=name, description=description, admins=[Admin(user=author)])
+        async with self.bot.database.async_session() as session:
+            session.add(hub)
+            await session.commit()
+        self.name_index.add(author, hub.name)
+        self.names_changed(author)
+        
+        return hub
+    
+    def names_changed(self, user: int) -> None:
+        self.bot.autocomplete_cache.invalidate((user, AUTOCOMPLETE_KEY))
+
+    def edit_hub(
+        self,
+        hub: Hub,
+        name: str,
+        description: str = None,
+    ) -> Hub:
+        for admin in hub.admins:
+            self.name_index.rename(admin.user, hub.name, name)
+            self.names_changed(admin.user)
+        hub.name = name
+        hub.description = description
+        self.bot.embed_cache.bump(hub.embed_key)
+        return hub
+    
+    def warm_index(self) -> None:
+        self.name_index.warm(
+            self.bot.database.session.query(
+                Admin.user,
+                Hub.name,
+            ).join(
+                Admin.hub
+            )
+        )
+    
+    async def complete_names_async(
+        self,
+        user: Union[int, nextcord.Member, nextcord.User],
+        startswith="",
+        limit: int = 25,
+    ) -> List[str]:
+        if isinstance(user, (nextcord.Member, nextcord.User)):
+            user = user.id
+        if self.name_index.ready:
+            return self.name_index.search(user, startswith, limit)
+        # the index is still cold
+        return [hub.name for hub in await self.get_hubs_async(user, startswith, limit)]
+    
+    def select_hubs(
+        self,
+        user: int,
+        startswith: str = "",
+        limit: Optional[int] = None,
+    ) -> sqlalchemy.sql.Select:
+        query = sqlalchemy.select(
+            Hub
+        ).join(
+            Hub.admins
+        ).where(
+            Admin.user == user,
+            Hub.name.startswith(startswith),
+        ).options(
+            sqlalchemy.orm.selectinload(Hub.admins),
+        ).order_by(
+            Hub.name,
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+    
     def get_hubs(
         self,
         user: Union[int, nextcord.Member, nextcord.User],
         startswith="",
+        limit: Optional[int] = None,
     ) -> List[Hub]:
         if isinstance(user, (nextcord.Member, nextcord.User)):
             user = user.id
         
-        hubs = []
-        for admin in self.bot.database.session.query(
-            Admin
-        ).filter(
-            Admin.user==user,
-        ).all():
-            if admin.hub.name.startswith(startswith):
-                hubs.append(admin.hub)
+        return self.bot.database.session.execute(
+            self.select_hubs(user, startswith, limit)
+        ).scalars().all()
+    
+    async def get_hubs_async(
+        self,
+        user: Union[int, nextcord.Member, nextcord.User],
+        startswith="",
+        limit: Optional[int] = None,
+    ) -> List[Hub]:
+        if not self.bot.database.is_async:
+            return self.get_hubs(user, startswith, limit)
+        if isinstance(user, (nextcord.Member, nextcord.User)):
+            user = user.id
         
-        return hubs
+        async with self.bot.database.async_session() as session:
+            return (await session.execute(
+                self.select_hubs(user, startswith, limit)
+            )).scalars().all()
+    
+    def select_page(
+        self,
+        user: int,
+        cursor: Optional[int] = None,
+        backwards: bool = False,
+        limit: int = PAGE_SIZE,
+    ) -> sqlalchemy.sql.Select:
+        # seeks on the (user, hub_id) index of the admins
+        query = sqlalchemy.select(
+            Hub
+        ).join(
+            Hub.admins
+        ).where(
+            Admin.user == user,
+        )
+        if cursor is not None:
+            query = query.where(Admin.hub_id < cursor if backwards else Admin.hub_id > cursor)
+        return query.order_by(
+            Admin.hub_id.desc() if backwards else Admin.hub_id,
+        ).limit(limit + 1)
+
+    def get_page(
+        self,
+        user: Union[int, nextcord.Member, nextcord.User],
+        cursor: Optional[int] = None,
+        backwards: bool = False,
+        limit: int = PAGE_SIZE,
+    ) -> Page[Hub]:
+        if isinstance(user, (nextcord.Member, nextcord.User)):
+            user = user.id
+        rows = self.bot.database.session.execute(
+            self.select_page(user, cursor, backwards, limit)
+        ).scalars()
+        return Page.from_rows(
+            (hub for hub in map(self.bot.write_behind.overlay, rows) if hub is not None),
+            limit,
+            cursor,
+            backwards,
+        )
+
+    async def get_page_async(
+        self,
+        user: Union[int, nextcord.Member, nextcord.User],
+        cursor: Optional[int] = None,
+        backwards: bool = False,
+        limit: int = PAGE_SIZE,
+    ) -> Page[Hub]:
+        if not self.bot.database.is_async:
+            return self.get_page(user, cursor, backwards, limit)
+        if isinstance(user, (nextcord.Member, nextcord.User)):
+            user = user.id
+        async with self.bot.database.async_session() as session:
+            rows = (await session.execute(
+                self.select_page(user, cursor, backwards, limit)
+            )).scalars()
+            return Page.from_rows(
+                (hub for hub in map(self.bot.write_behind.overlay, rows) if hub is not None),
+                limit,
+                cursor,
+                backwards,
+            )
+
+    def select_hub_by_name(
+        self,
+        name: str,
+        user: int = None,
+    ) -> sqlalchemy.sql.Select:
+        query = sqlalchemy.select(
+            Hub
+        ).where(
+            Hub.name == name,
+        ).options(
+            sqlalchemy.orm.selectinload(Hub.admins),
+        ).limit(1)
+        if user is not None:
+            query = query.join(Hub.admins).where(Admin.user == user)
+        return query
     
     def get_hub_by_name(
         self, 
         name: str,
-        user: int = None,
+        user: Union[int, nextcord.Member, nextcord.User, None] = None,
     ) -> Optional[Hub]:
-        try:
-            hubs = self.bot.database.session.query(
-                Hub
-            ).filter(
-                Hub.name == name,
-            ).all()
-        except sqlalchemy.orm.exc.NoResultFound:
-            raise None
+        if isinstance(user, (nextcord.Member, nextcord.User)):
+            user = user.id
+        return self.bot.write_behind.overlay(self.bot.database.session.execute(
+            self.select_hub_by_name(name, user)
+        ).scalars().first())
+    
+    async def get_hub_by_name_async(
+        self,
+        name: str,
+        user: Union[int, nextcord.Member, nextcord.User, None] = None,
+    ) -> Optional[Hub]:
+        if isinstance(user, (nextcord.Member, nextcord.User)):
+            user = user.id
+        if not self.bot.database.is_async:
+            return self.get_hub_by_name(name, user)
+        
+        async with self.bot.database.async_session() as session:
+            return self.bot.write_behind.overlay((await session.execute(
+                self.select_hub_by_name(name, user)
+            )).scalars().first())
+    
+    @staticmethod
+    def get_search_terms(query: str) -> List[str]:
+        return [term for term in query.split() if len(term) > 0]
+
+    def select_search(
+        self,
+        query: str,
+        cursor: Optional[Tuple[float, int]] = None,
+        backwards: bool = False,
+        limit: int = SEARCH_LIMIT,
+    ) -> sqlalchemy.sql.Select:
+        # ordered by (rank, id), the cursor is the key of the first or last result of a page
+        terms = self.get_search_terms(query)
+        if self.bot.database.is_sqlite:
+            # every term is quoted so the query can't use the fts5 syntax, and matches as a prefix
+            match = " ".join('"' + term.replace('"', '""') + '"*' for term in terms)
+            rank = HUB_SEARCH.c.rank
+            select = sqlalchemy.select(
+                Hub,
+                rank,
+            ).join(
+                HUB_SEARCH,
+                HUB_SEARCH.c.rowid == Hub.id,
+            ).where(
+                sqlalchemy.literal_column(HUB_SEARCH_TABLE).op("MATCH")(match),
+            )
         else:
-            if user is not None:
-                user_hubs = []
-                admins = self.bot.database.session.query(
-                    Admin
-                ).filter(
-                    Admin.user == user,
-                ).all()
-                for admin in admins:
-                    if admin.hub in hubs:
-                        user_hubs.append(admin.hub)
-                hubs = user_hubs
-            if len(hubs) > 0:
-                return hubs[0]
+            # the hubs whose name matches come first
+            name = sqlalchemy.func.lower(Hub.name)
+            description = sqlalchemy.func.lower(sqlalchemy.func.coalesce(Hub.description, ""))
+            rank = sqlalchemy.case(
+                (sqlalchemy.and_(*(name.contains(term.lower(), autoescape=True) for term in terms)), 0.0),
+                else_=1.0,
+            )
+            select = sqlalchemy.select(
+                Hub,
+                rank,
+            ).where(*(
+                sqlalchemy.or_(
+                    name.contains(term.lower(), autoescape=True),
+                    description.contains(term.lower(), autoescape=True),
+                )
+                for term in terms
+            ))
+        if cursor is not None:
+            cursor_rank, cursor_id = cursor
+            if backwards:
+                select = select.where(sqlalchemy.or_(
+                    rank < cursor_rank,
+                    sqlalchemy.and_(rank == cursor_rank, Hub.id < cursor_id),
+                ))
             else:
-                return None
-    
+                select = select.where(sqlalchemy.or_(
+                    rank > cursor_rank,
+                    sqlalchemy.and_(rank == cursor_rank, Hub.id > cursor_id),
+                ))
+        if backwards:
+            return select.order_by(rank.desc(), Hub.id.desc()).limit(limit + 1)
+        return select.order_by(rank, Hub.id).limit(limit + 1)
+
+    def search_hubs(
+        self,
+        query: str,
+        cursor: Optional[Tuple[float, int]] = None,
+        backwards: bool = False,
+        limit: int = SEARCH_LIMIT,
+    ) -> Page[Tuple[Hub, float]]:
+        if len(self.get_search_terms(query)) == 0:
+            return Page([], False, False)
+        rows = self.bot.database.session.execute(
+            self.select_search(query, cursor, backwards, limit)
+        ).all()
+        return Page.from_rows(
+            ((hub, rank) for hub, rank in rows if self.bot.write_behind.overlay(hub) is not None),
+            limit,
+            cursor,
+            backwards,
+        )
+
+    async def search_hubs_async(
+        self,
+        query: str,
+        cursor: Optional[Tuple[float, int]] = None,
+        backwards: bool = False,
+        limit: int = SEARCH_LIMIT,
+    ) -> Page[Tuple[Hub, float]]:
+        if not self.bot.database.is_async:
+            return self.search_hubs(query, cursor, backwards, limit)
+        if len(self.get_search_terms(query)) == 0:
+            return Page([], False, False)
+        async with self.bot.database.async_session() as session:
+            rows = (await session.execute(
+                self.select_search(query, cursor, backwards, limit)
+            )).all()
+        return Page.from_rows(
+            ((hub, rank) for hub, rank in rows if self.bot.write_behind.overlay(hub) is not None),
+            limit,
+            cursor,
+            backwards,
+        )
+
     def get_hub_by_id(self, id: int) -> Hub:
         try:
-            return self.bot.database.session.query(
-                Hub
-            ).filter(
-                Hub.id==id,
-            ).one()
+            return self.bot.write_behind.overlay(
+                self.bot.database.session.query(
+                    Hub
+                ).filter(
+                    Hub.id==id,
+                ).one()
+            )
         except sqlalchemy.exc.NoResultFound:
             return None
     
+    async def get_hub_by_id_async(self, id: int) -> Optional[Hub]:
+        if not self.bot.database.is_async:
+            return self.get_hub_by_id(id)
+        async with self.bot.database.async_session() as session:
+            return self.bot.write_behind.overlay(await session.get(
+                Hub,
+                id,
+                options=[sqlalchemy.orm.selectinload(Hub.admins)],
+            ))
+    
     def get_hub(self, raw_custom_id: str) -> Hub:
-        custom_id = self.bot.get_int_from_base64(raw_custom_id)
-        return self.get_hub_by_id(custom_id)
+        return self.get_hub_by_id(decode_id(raw_custom_id))
+    
+    async def get_hub_async(self, raw_custom_id: str) -> Optional[Hub]:
+        return await self.get_hub_by_id_async(decode_id(raw_custom_id))
 
     def delete_hub(self, hub: Hub):
-        self.bot.database.session.delete(hub)
+        for admin in hub.admins:
+            self.name_index.remove(admin.user, hub.name)
+            self.names_changed(admin.user)
+        self.bot.embed_cache.bump(hub.embed_key)
+        self.bot.write_behind.delete(hub)
+    
+    async def delete_hub_async(self, hub: Hub):
+        if not self.bot.database.is_async:
+            return self.delete_hub(hub)
+        for admin in hub.admins:
+            self.name_index.remove(admin.user, hub.name)
+            self.names_changed(admin.user)
+        self.bot.embed_cache.bump(hub.embed_key)
+        async with self.bot.database.async_session() as session:
+            hub = await session.get(
+                Hub,
+                hub.id,
+                options=[sqlalchemy.orm.selectinload(Hub.rolelinks).selectinload(Rolelink.roles)],
+            )
+            if hub is not None:
+                await session.delete(hub)
+                await session.commit()
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import sqlalchemy
+
+from gunibot import create_index, create_table
+
+from .hub import HUB_SEARCH_TABLE, Admin, Hub
+from .rolelink import Role, Rolelink
+
+def add_lookup_indexes(connection: sqlalchemy.engine.Connection) -> None:
+    # an admin registered twice on a hub keeps its oldest row
+    first = sqlalchemy.select(
+        sqlalchemy.func.min(Admin.id)
+    ).group_by(
+        Admin.user,
+        Admin.hub_id,
+    )
+    connection.execute(
+        sqlalchemy.delete(
+            Admin
+        ).where(
+            Admin.id.not_in(first),
+        )
+    )
+    create_index(connection, Admin.__table__, "ix_rolelink_hub_admins_user_hub")
+    create_index(connection, Admin.__table__, "ix_rolelink_hub_admins_hub")
+    create_index(connection, Hub.__table__, "ix_rolelink_hubs_name")
+
+def add_rolelinks(connection: sqlalchemy.engine.Connection) -> None:
+    create_table(connection, Rolelink.__table__)
+    create_table(connection, Role.__table__)
+
+def add_hub_search(connection: sqlalchemy.engine.Connection) -> None:
+    # the other databases search with LIKE
+    if connection.dialect.name != "sqlite":
+        return
+    # an external content table, the triggers keep the index in sync with the hubs
+    connection.execute(sqlalchemy.text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {HUB_SEARCH_TABLE} USING fts5("
+        "name, description, content='rolelink_hubs', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    connection.execute(sqlalchemy.text(
+        f"CREATE TRIGGER IF NOT EXISTS {HUB_SEARCH_TABLE}_insert AFTER INSERT ON rolelink_hubs BEGIN "
+        f"INSERT INTO {HUB_SEARCH_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+        "END"
+    ))
+    connection.execute(sqlalchemy.text(
+        f"CREATE TRIGGER IF NOT EXISTS {HUB_SEARCH_TABLE}_delete AFTER DELETE ON rolelink_hubs BEGIN "
+        f"INSERT INTO {HUB_SEARCH_TABLE}({HUB_SEARCH_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+        "END"
+    ))
+    connection.execute(sqlalchemy.text(
+        f"CREATE TRIGGER IF NOT EXISTS {HUB_SEARCH_TABLE}_update AFTER UPDATE OF name, description ON rolelink_hubs BEGIN "
+        f"INSERT INTO {HUB_SEARCH_TABLE}({HUB_SEARCH_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description); "
+        f"INSERT INTO {HUB_SEARCH_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+        "END"
+    ))
+    # indexes the hubs created before the table
+    connection.execute(sqlalchemy.text(
+        f"INSERT INTO {HUB_SEARCH_TABLE}({HUB_SEARCH_TABLE}) VALUES ('rebuild')"
+    ))
+
+# append only, the version of the schema is the number of migrations applied
+MIGRATIONS = [
+    add_lookup_indexes,
+    add_rolelinks,
+    add_hub_search,
+]
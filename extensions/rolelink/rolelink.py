@@ -1,19 +1,207 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple, Union
+
 import sqlalchemy
+import sqlalchemy.orm
+import nextcord
+
 from gunibot import Base
 
+if TYPE_CHECKING:
+    from gunibot import Gunibot
+    from .hub import Hub
+
 class Rolelink(Base):
     __tablename__="rolelink"
-    
+
     id: int = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     name: str = sqlalchemy.Column(sqlalchemy.String)
-    
-    roles = sqlalchemy.orm.relationship("Role", back_populates="rolelink")
+    hub_id: int = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("rolelink_hubs.id"), index=True)
+
+    roles: List[Role] = sqlalchemy.orm.relationship("Role", back_populates="rolelink", cascade="all, delete-orphan")
+    hub: Hub = sqlalchemy.orm.relationship("Hub", back_populates="rolelinks")
+
+    @property
+    def guild_roles(self) -> Dict[int, int]:
+        # guild id -> the linked role of the guild
+        return {role.guild: role.id for role in self.roles}
 
 class Role(Base):
     __tablename__="rolelink_role"
-    
-    rolelink: int = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("rolelink.id"))
-    id: int = sqlalchemy.Column(sqlalchemy.BigInteger)
-    guild: int = sqlalchemy.Column(sqlalchemy.BigInteger)
-    
-    rolelink: Rolelink = sqlalchemy.orm.relationship("Rolelink", back_populates="roles")
\ No newline at end of file
+
+    # the ids of discord roles are unique across guilds
+    id: int = sqlalchemy.Column(sqlalchemy.BigInteger, primary_key=True, autoincrement=False)
+    rolelink_id: int = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("rolelink.id"), index=True)
+    guild: int = sqlalchemy.Column(sqlalchemy.BigInteger, nullable=False)
+
+    rolelink: Rolelink = sqlalchemy.orm.relationship("Rolelink", back_populates="roles")
+
+class RolelinkIndex:
+    # the linked roles of every guild, so a member update is filtered without querying
+    def __init__(self) -> None:
+        self.ready = False
+        # guild id -> role id -> rolelink id
+        self._guilds: Dict[int, Dict[int, int]] = {}
+        # rolelink id -> guild id -> role id
+        self._links: Dict[int, Dict[int, int]] = {}
+        # rolelink id -> hub id
+        self._hubs: Dict[int, int] = {}
+        # hub id -> guild id -> number of roles linked in the guild
+        self._hub_guilds: Dict[int, Dict[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def warm(self, rows: Iterable[Tuple[int, Optional[int], Optional[int], Optional[int]]]) -> None:
+        # rows of (rolelink id, hub id, role id, guild id), without role for an empty rolelink
+        self._guilds = {}
+        self._links = {}
+        self._hubs = {}
+        self._hub_guilds = {}
+        for rolelink, hub, role, guild in rows:
+            self.add_rolelink(rolelink, hub)
+            if role is not None:
+                self.add(rolelink, guild, role)
+        self.ready = True
+
+    def add_rolelink(self, rolelink: int, hub: Optional[int]) -> None:
+        self._links.setdefault(rolelink, {})
+        self._hubs[rolelink] = hub
+
+    def remove_rolelink(self, rolelink: int) -> None:
+        for guild, role in list(self._links.get(rolelink, {}).items()):
+            self.remove(rolelink, guild, role)
+        self._links.pop(rolelink, None)
+        self._hubs.pop(rolelink, None)
+
+    def remove_hub(self, hub: int) -> None:
+        # the rolelinks of a hub are deleted with it
+        for rolelink in [rolelink for rolelink, rolelink_hub in self._hubs.items() if rolelink_hub == hub]:
+            self.remove_rolelink(rolelink)
+        self._hub_guilds.pop(hub, None)
+
+    def add(self, rolelink: int, guild: int, role: int) -> None:
+        self._guilds.setdefault(guild, {})[role] = rolelink
+        self._links.setdefault(rolelink, {})[guild] = role
+        hub = self._hubs.get(rolelink)
+        if hub is not None:
+            guilds = self._hub_guilds.setdefault(hub, {})
+            guilds[guild] = guilds.get(guild, 0) + 1
+
+    def remove(self, rolelink: int, guild: int, role: int) -> None:
+        roles = self._guilds.get(guild)
+        if roles is None or roles.get(role) != rolelink:
+            return
+        del roles[role]
+        if len(roles) == 0:
+            del self._guilds[guild]
+        self._links[rolelink].pop(guild, None)
+        hub = self._hubs.get(rolelink)
+        guilds = self._hub_guilds.get(hub)
+        if guilds is not None and guild in guilds:
+            guilds[guild] -= 1
+            if guilds[guild] == 0:
+                del guilds[guild]
+            if len(guilds) == 0:
+                del self._hub_guilds[hub]
+
+    def get_guild(self, guild: int) -> Optional[Dict[int, int]]:
+        # role id -> rolelink id, None when nothing is linked in the guild
+        return self._guilds.get(guild)
+
+    def get_guild_roles(self, rolelink: int) -> Dict[int, int]:
+        # guild id -> the linked role of the guild, not to be modified
+        return self._links.get(rolelink, {})
+
+    def get_hub_guilds(self, hub: int) -> Set[int]:
+        return set(self._hub_guilds.get(hub, ()))
+
+class RolelinkManager:
+    def __init__(self, bot: Gunibot) -> None:
+        self.bot = bot
+        self.index = RolelinkIndex()
+
+        self.bot.add_orm(Rolelink)
+        self.bot.add_orm(Role)
+
+    def create_rolelink(self, hub: Hub, name: str) -> Rolelink:
+        if self.get_rolelink_by_name(hub, name) is not None:
+            raise ValueError("The name is already used")
+        rolelink = Rolelink(hub_id=hub.id, name=name)
+        self.bot.database.session.add(rolelink)
+        self.bot.database.session.commit()
+        self.index.add_rolelink(rolelink.id, rolelink.hub_id)
+        return rolelink
+
+    def add_role(self, rolelink: Rolelink, role: nextcord.Role) -> Role:
+        for linked in rolelink.roles:
+            if linked.guild == role.guild.id:
+                raise ValueError("The rolelink already has a role in this guild")
+        linked = Role(id=role.id, guild=role.guild.id)
+        rolelink.roles.append(linked)
+        try:
+            self.bot.database.session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            self.bot.database.session.rollback()
+            raise ValueError("The role is already linked")
+        self.index.add(rolelink.id, linked.guild, linked.id)
+        return linked
+
+    def remove_role(self, rolelink: Rolelink, role: Union[int, nextcord.Role]) -> None:
+        if isinstance(role, nextcord.Role):
+            role = role.id
+        removed = [linked for linked in rolelink.roles if linked.id == role]
+        rolelink.roles = [linked for linked in rolelink.roles if linked.id != role]
+        self.bot.database.session.commit()
+        for linked in removed:
+            self.index.remove(rolelink.id, linked.guild, linked.id)
+
+    def delete_rolelink(self, rolelink: Rolelink) -> None:
+        self.bot.database.session.delete(rolelink)
+        self.bot.database.session.commit()
+        self.index.remove_rolelink(rolelink.id)
+
+    def get_rolelink(self, id: int) -> Optional[Rolelink]:
+        return self.bot.database.session.get(Rolelink, id)
+
+    def get_rolelink_by_name(self, hub: Hub, name: str) -> Optional[Rolelink]:
+        return self.bot.database.session.execute(
+            sqlalchemy.select(
+                Rolelink
+            ).where(
+                Rolelink.hub_id == hub.id,
+                Rolelink.name == name,
+            ).options(
+                sqlalchemy.orm.selectinload(Rolelink.roles),
+            ).limit(1)
+        ).scalars().first()
+
+    def warm_index(self) -> None:
+        # a single query, the rolelinks without roles included
+        self.index.warm(
+            self.bot.database.session.execute(
+                sqlalchemy.select(
+                    Rolelink.id,
+                    Rolelink.hub_id,
+                    Role.id,
+                    Role.guild,
+                ).outerjoin(
+                    Role,
+                    Role.rolelink_id == Rolelink.id,
+                )
+            )
+        )
+
+    def get_links(self, guild: int, roles: Iterable[int]) -> Dict[int, Rolelink]:
+        # role id -> its rolelink, for the roles of the guild which are linked
+        linked = self.bot.database.session.execute(
+            sqlalchemy.select(
+                Role
+            ).where(
+                Role.guild == guild,
+                Role.id.in_(list(roles)),
+            ).options(
+                sqlalchemy.orm.selectinload(Role.rolelink).selectinload(Rolelink.roles),
+            )
+        ).scalars().all()
+        return {role.id: role.rolelink for role in linked}
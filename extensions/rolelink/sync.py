@@ -0,0 +1,202 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+import asyncio
+import time
+
+import nextcord
+
+from gunibot import RateLimiter
+
+if TYPE_CHECKING:
+    from gunibot import Gunibot
+
+# the changes of a user are gathered this long before being applied
+COALESCE_DELAY = 1
+# the edits of our own changes come back as member updates
+ECHO_TTL = 60
+# discord allows 50 requests per second globally, the member edits are limited per guild
+GLOBAL_RATE = 50
+GUILD_RATE = 1
+GUILD_CAPACITY = 5
+
+REASON = "Rolelink"
+
+class RoleSync:
+    # propagates the linked roles to the other guilds of a hub with the fewest edits
+    def __init__(self, bot: Gunibot) -> None:
+        self.bot = bot
+        self.logger = self.bot.get_logger("rolelink.sync")
+        self.limiter = RateLimiter(
+            GLOBAL_RATE,
+            GLOBAL_RATE,
+            GUILD_RATE,
+            GUILD_CAPACITY,
+        )
+
+        # guild id -> user id -> role id -> whether the user should have the role
+        self._pending: Dict[int, Dict[int, Dict[int, bool]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        # (guild, user, role, state) -> expiration of the echo of an edit
+        self._echoes: Dict[Tuple[int, int, int, bool], float] = {}
+
+        self.edits = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "guilds": len(self._pending),
+            "users": sum(len(users) for users in self._pending.values()),
+            "edits": self.edits,
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+            "failed": self.failed,
+        }
+
+    def stop(self) -> None:
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers = {}
+        self._pending = {}
+
+    def is_echo(self, guild: int, user: int, role: int, state: bool) -> bool:
+        expiration = self._echoes.pop((guild, user, role, state), None)
+        return expiration is not None and expiration > time.monotonic()
+
+    def propagate(
+        self,
+        user: int,
+        guild_roles: Dict[int, int],
+        state: bool,
+        origin: Optional[int] = None,
+    ) -> None:
+        # guild_roles maps each guild of a rolelink to its linked role
+        if origin is not None and self.is_echo(origin, user, guild_roles[origin], state):
+            return
+        for guild, role in guild_roles.items():
+            if guild != origin:
+                self.enqueue(guild, user, role, state)
+
+    def enqueue(self, guild: int, user: int, role: int, state: bool) -> None:
+        changes = self._pending.setdefault(guild, {}).setdefault(user, {})
+        if role in changes:
+            self.coalesced += 1
+        changes[role] = state
+        if guild not in self._workers:
+            self._workers[guild] = asyncio.get_running_loop().create_task(self._worker(guild))
+
+    async def _worker(self, guild_id: int) -> None:
+        try:
+            await asyncio.sleep(COALESCE_DELAY)
+            pending = self._pending.get(guild_id, {})
+            while len(pending) > 0:
+                user = next(iter(pending))
+                changes = pending.pop(user)
+                try:
+                    await self._apply(guild_id, user, changes)
+                except Exception:
+                    self.failed += 1
+                    self.logger.exception(f"Unable to update the roles of {user} in {guild_id}")
+        finally:
+            self._workers.pop(guild_id, None)
+            if len(self._pending.get(guild_id, {})) == 0:
+                self._pending.pop(guild_id, None)
+
+    async def _get_member(self, guild: nextcord.Guild, user: int) -> Optional[nextcord.Member]:
+        member = guild.get_member(user)
+        if member is None:
+            await self.limiter.acquire(guild.id)
+            try:
+                member = await guild.fetch_member(user)
+            except nextcord.NotFound: # not a member of this guild
+                return None
+        return member
+
+    async def _apply(self, guild_id: int, user: int, changes: Dict[int, bool]) -> None:
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+        member = await self._get_member(guild, user)
+        if member is None:
+            return
+
+        current = {role.id for role in member.roles if role.id != guild.id}
+        add = {role for role, state in changes.items() if state and role not in current and guild.get_role(role) is not None}
+        remove = {role for role, state in changes.items() if not state and role in current}
+        if len(add) == 0 and len(remove) == 0:
+            self.skipped += 1
+            return
+
+        await self.limiter.acquire(guild.id)
+        try:
+            # a single role is added or removed without sending the whole list
+            if len(add) == 1 and len(remove) == 0:
+                await member.add_roles(nextcord.Object(next(iter(add))), reason=REASON)
+            elif len(add) == 0 and len(remove) == 1:
+                await member.remove_roles(nextcord.Object(next(iter(remove))), reason=REASON)
+            else:
+                await member.edit(
+                    roles=[nextcord.Object(role) for role in (current - remove) | add],
+                    reason=REASON,
+                )
+        except nextcord.HTTPException as e:
+            if e.status == 429:
+                retry_after = float(e.response.headers.get('Retry-After', 1))
+                self.limiter.penalize(retry_after)
+            raise
+        self.edits += 1
+
+        expiration = time.monotonic() + ECHO_TTL
+        for role in add:
+            self._echoes[(guild.id, user, role, True)] = expiration
+        for role in remove:
+            self._echoes[(guild.id, user, role, False)] = expiration
+        if len(self._echoes) > 10000:
+            now = time.monotonic()
+            self._echoes = {key: value for key, value in self._echoes.items() if value > now}
+
+    async def _scan(self, guild: nextcord.Guild, role: nextcord.Role) -> Tuple[Set[int], Set[int]]:
+        # the members of the guild and the ones who have the role, in a single pass
+        if guild.chunked:
+            return {member.id for member in guild.members}, {member.id for member in role.members}
+        members: Set[int] = set()
+        holders: Set[int] = set()
+        # pages of 1000 members
+        async for member in guild.fetch_members(limit=None):
+            members.add(member.id)
+            if member.get_role(role.id) is not None:
+                holders.add(member.id)
+        return members, holders
+
+    async def reconcile(self, guild_roles: Dict[int, int], source: Optional[int] = None) -> int:
+        # the desired holders are the ones of the source guild, or of any guild without a source,
+        # the other guilds get the difference with their actual holders
+        scans: Dict[int, Tuple[int, Set[int], Set[int]]] = {}
+        for guild_id, role_id in guild_roles.items():
+            guild = self.bot.get_guild(guild_id)
+            role = guild.get_role(role_id) if guild is not None else None
+            if role is None:
+                continue
+            scans[guild_id] = (role_id, *await self._scan(guild, role))
+
+        if source is not None:
+            if source not in scans:
+                return 0
+            desired = scans[source][2]
+        else:
+            desired = set().union(*(holders for _, _, holders in scans.values()))
+
+        queued = 0
+        for guild_id, (role_id, members, holders) in scans.items():
+            if guild_id == source:
+                continue
+            for user in (desired & members) - holders:
+                self.enqueue(guild_id, user, role_id, True)
+                queued += 1
+            for user in holders - desired:
+                self.enqueue(guild_id, user, role_id, False)
+                queued += 1
+        return queued
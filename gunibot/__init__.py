@@ -1,5 +1,14 @@
 from .bot import *
 from .configuration import *
 from .database import *
+from .embed_cache import *
+from .migrations import *
+from .autocomplete import *
+from .components import *
+from .pagination import *
+from .ratelimit import *
+from .router import *
+from .user_cache import *
+from .write_behind import *
 
-EMPTY_AUTOCOMPLETE = "Je n'ai rien trouvé !"
\ No newline at end of file
+EMPTY_AUTOCOMPLETE = "Je n'ai rien trouvé !"
@@ -0,0 +1,143 @@
+from __future__ import annotations
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+
+import bisect
+import time
+
+__all__ = [
+    "PrefixIndex",
+    "AutocompleteCache",
+]
+
+class PrefixIndex:
+    # sorted names per owner, searched with bisect and case insensitive like sqlite's LIKE
+    def __init__(self) -> None:
+        self.ready = False
+        self._entries: Dict[Hashable, List[Tuple[str, str]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def warm(self, items: Iterable[Tuple[Hashable, str]]) -> None:
+        entries: Dict[Hashable, List[Tuple[str, str]]] = {}
+        for owner, name in items:
+            if name is not None:
+                entries.setdefault(owner, []).append((name.casefold(), name))
+        for owner_entries in entries.values():
+            owner_entries.sort()
+        self._entries = entries
+        self.ready = True
+
+    def add(self, owner: Hashable, name: str) -> None:
+        if name is None:
+            return
+        bisect.insort(self._entries.setdefault(owner, []), (name.casefold(), name))
+
+    def remove(self, owner: Hashable, name: str) -> None:
+        entries = self._entries.get(owner)
+        if entries is None or name is None:
+            return
+        entry = (name.casefold(), name)
+        index = bisect.bisect_left(entries, entry)
+        if index < len(entries) and entries[index] == entry:
+            del entries[index]
+            if len(entries) == 0:
+                del self._entries[owner]
+
+    def rename(self, owner: Hashable, old: str, new: str) -> None:
+        if old != new:
+            self.remove(owner, old)
+            self.add(owner, new)
+
+    def search(self, owner: Hashable, prefix: str, limit: int = 25) -> List[str]:
+        entries = self._entries.get(owner)
+        if entries is None:
+            return []
+        prefix = prefix.casefold()
+        names = []
+        for index in range(bisect.bisect_left(entries, (prefix,)), len(entries)):
+            folded, name = entries[index]
+            if not folded.startswith(prefix) or len(names) >= limit:
+                break
+            names.append(name)
+        return names
+
+
+class AutocompleteSession:
+    def __init__(self) -> None:
+        self.prefix: Optional[str] = None
+        self.candidates: List[str] = []
+        self.complete = False
+        self.updated = 0.0
+        self.generation = 0
+
+class AutocompleteCache:
+    # remembers the last candidates of each (user, option) while the user is typing
+    def __init__(
+        self,
+        ttl: float = 15,
+        candidates: int = 100,
+        max_sessions: int = 10000,
+    ) -> None:
+        self.ttl = ttl
+        self.candidates = candidates
+        self.max_sessions = max_sessions
+        self.hits = 0
+        self.misses = 0
+        self.superseded = 0
+        self._sessions: OrderedDict[Hashable, AutocompleteSession] = OrderedDict()
+
+    def _get_session(self, key: Hashable) -> AutocompleteSession:
+        try:
+            session = self._sessions[key]
+        except KeyError:
+            session = AutocompleteSession()
+            self._sessions[key] = session
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(key)
+        return session
+
+    def invalidate(self, key: Hashable) -> None:
+        # the names of the key changed, the next keystroke fetches them again
+        self._sessions.pop(key, None)
+
+    def narrow(self, session: AutocompleteSession, prefix: str) -> Optional[List[str]]:
+        if (
+            session.prefix is None
+            or not session.complete
+            or time.monotonic() - session.updated > self.ttl
+            or not prefix.casefold().startswith(session.prefix.casefold())
+        ):
+            return None
+        folded = prefix.casefold()
+        return [name for name in session.candidates if name.casefold().startswith(folded)]
+
+    async def complete(
+        self,
+        key: Hashable,
+        prefix: str,
+        fetch: Callable[[str, int], Awaitable[List[str]]],
+        limit: int = 25,
+    ) -> Optional[List[str]]:
+        # returns None when a newer keystroke superseded this one
+        session = self._get_session(key)
+        session.generation += 1
+        generation = session.generation
+
+        candidates = self.narrow(session, prefix)
+        if candidates is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            candidates = await fetch(prefix, self.candidates)
+            if session.generation != generation:
+                self.superseded += 1
+                return None
+            session.prefix = prefix
+            session.candidates = candidates
+            session.complete = len(candidates) < self.candidates
+            session.updated = time.monotonic()
+        return candidates[:limit]
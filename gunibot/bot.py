@@ -1,14 +1,19 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING, Dict, Optional
+from typing import TYPE_CHECKING, Dict, Iterable, Optional
 
 import logging
-import base64
 
 import nextcord
 from nextcord.ext import commands
 
+from .autocomplete import AutocompleteCache
 from .configuration import Configuration
 from .database import Database
+from .embed_cache import EmbedCache
+from .migrations import Migration, MigrationRunner
+from .router import ComponentRouter
+from .user_cache import UserCache
+from .write_behind import WriteBehind
 
 if TYPE_CHECKING:
     from .database import Base
@@ -20,18 +25,30 @@ __all__ = [
 class Gunibot(commands.Bot):
     def __init__(self) -> None:
         self.configuration = Configuration()
+        intents = nextcord.Intents.default()
+        intents.members = self.configuration.members_intent
         super().__init__(
             self.configuration.prefix,
-            description=self.configuration.description
+            description=self.configuration.description,
+            intents=intents,
         )
         self.database = Database(self)
+        self.migrations = MigrationRunner(self)
+        self.autocomplete_cache = AutocompleteCache()
+        self.user_cache = UserCache(self)
+        self.embed_cache = EmbedCache()
+        self.write_behind = WriteBehind(self)
+        self.router = ComponentRouter(self)
+        self.add_listener(self.router.on_interaction, "on_interaction")
     
     def get_logger(self, name: str = ...) -> logging.Logger:
         return logging.getLogger(name)
     
     def run(self) -> None:
         self.database.connect()
-        self.database.create_all()
+        if self.database.is_sqlite:
+            self.database.check_sqlite()
+        self.migrations.run()
         
         super().run(self.configuration.token)
     
@@ -39,19 +56,17 @@ class Gunibot(commands.Bot):
         self,
         user_id: int,
     ) -> Optional[nextcord.User]:
-        user = self.get_user(user_id)
-        if user is None:
-            return await self.fetch_user(user_id)
-        return user
+        return await self.user_cache.get(user_id)
     
     async def close(self) -> None:
         await super().close()
+        self.write_behind.flush()
         self.database.session.commit()
         self.database.close()
+        await self.database.dispose()
     
     def add_orm(self, object: Base) -> None:
         self.database.add(object)
     
-    def get_int_from_base64(self, bytes: str) -> int:
-        bytes = base64.b64decode(bytes)
-        return int.from_bytes(bytes, byteorder='little')
+    def add_migrations(self, namespace: str, migrations: Iterable[Migration]) -> None:
+        self.migrations.add(namespace, migrations)
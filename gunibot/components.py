@@ -0,0 +1,56 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterable, List
+
+import nextcord
+
+__all__ = [
+    "ComponentTemplate",
+    "RenderedComponents",
+]
+
+# discord allows 5 buttons per action row
+ROW_SIZE = 5
+
+class RenderedComponents:
+    # the components payload of a message, accepted by nextcord wherever a View is
+    __discord_ui_view__ = True
+    # never stored by nextcord, the router dispatches the clicks
+    prevent_update = False
+
+    __slots__ = ("components", "timeout")
+
+    def __init__(self, components: List[Dict[str, Any]]) -> None:
+        self.components = components
+        self.timeout = None
+
+    def to_components(self) -> List[Dict[str, Any]]:
+        return self.components
+
+    def is_finished(self) -> bool:
+        return True
+
+class ComponentTemplate:
+    # components built once, the "{}" of their custom ids are formatted on each render
+    def __init__(self, items: Iterable[nextcord.ui.Item]) -> None:
+        components = [item.to_component_dict() for item in items]
+        self._rows = [
+            components[index:index + ROW_SIZE]
+            for index in range(0, len(components), ROW_SIZE)
+        ]
+
+    def render(self, *args: object, disabled: bool = False) -> RenderedComponents:
+        return RenderedComponents([
+            {
+                "type": nextcord.ComponentType.action_row.value,
+                "components": [
+                    {
+                        **component,
+                        "custom_id": component["custom_id"].format(*args),
+                        # the items disabled in the template stay disabled
+                        "disabled": disabled or component.get("disabled", False),
+                    }
+                    for component in row
+                ],
+            }
+            for row in self._rows
+        ])
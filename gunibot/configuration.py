@@ -36,6 +36,10 @@ class Configuration:
     def guild_ids(self) -> List[int]:
         return self._raw_config['discord'].get('guild_ids', [])
 
+    @property
+    def members_intent(self) -> bool:
+        return self._raw_config['discord'].get('members_intent', False)
+
     @property
     def database_path(self) -> str:
         return self._raw_config.get('database', {}).get('path', 'database.db')
@@ -47,6 +51,38 @@ class Configuration:
     @property
     def database_location(self) -> str:
         return self._raw_config.get('database', {}).get('location', '')
+    
+    @property
+    def database_pool(self) -> Dict[str, Any]:
+        return self._raw_config.get('database', {}).get('pool', {})
+    
+    @property
+    def database_async(self) -> bool:
+        return self._raw_config.get('database', {}).get('async', False)
+
+    @property
+    def database_sqlite(self) -> Dict[str, Any]:
+        return self._raw_config.get('database', {}).get('sqlite', {})
+
+    @property
+    def reminders_missed_policy(self) -> str:
+        return self._raw_config.get('reminders', {}).get('missed_policy', 'once')
+    
+    @property
+    def reminders_missed_cap(self) -> int:
+        return self._raw_config.get('reminders', {}).get('missed_cap', 10)
+    
+    @property
+    def reminders_missed_grace(self) -> int:
+        return self._raw_config.get('reminders', {}).get('missed_grace', 120)
+    
+    @property
+    def reminders_delivery_workers(self) -> int:
+        return self._raw_config.get('reminders', {}).get('delivery_workers', 8)
+    
+    @property
+    def reminders_delivery_deadline(self) -> float:
+        return self._raw_config.get('reminders', {}).get('delivery_deadline', 30)
 
     def add_guilds(self, command: nextcord.ApplicationCommand) -> nextcord.ApplicationCommand:
         for guild_id in self.guild_ids:
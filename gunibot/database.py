@@ -1,7 +1,14 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Coroutine, Dict, Generator, Iterator, Optional, TypeVar
+from contextvars import ContextVar
+import contextlib
+import functools
+import types
+
+import nextcord
 import sqlalchemy
 import sqlalchemy.orm
+import sqlalchemy.ext.asyncio
 
 if TYPE_CHECKING:
     from .bot import Gunibot
@@ -9,25 +16,187 @@ if TYPE_CHECKING:
 __all__ = [
     "Database",
     "Base",
+    "unit_of_work",
 ]
 
 Base = sqlalchemy.orm.declarative_base()
 
+T = TypeVar("T")
+
+# the session of the unit of work running in the current task, if any
+_current_session: ContextVar[Optional[sqlalchemy.orm.Session]] = ContextVar(
+    "current_session",
+    default=None,
+)
+
+# the asyncio drivers used for each database type
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+# the pragmas applied to every sqlite connection, overridden by database.sqlite
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 268435456,
+    "cache_size": -65536,
+    "temp_store": "memory",
+    "busy_timeout": 5000,
+}
+
+# sqlite reads these pragmas back as numbers
+SQLITE_PRAGMA_NAMES = {
+    "synchronous": {0: "off", 1: "normal", 2: "full", 3: "extra"},
+    "temp_store": {0: "default", 1: "file", 2: "memory"},
+}
+
 class Database:
     def __init__(self, bot: Gunibot) -> None:
         self.bot = bot
         self.models = []
         self.Base = Base
         self.engine = sqlalchemy.create_engine(
-            f"{self.bot.configuration.database_type}://{self.bot.configuration.database_location}/{self.bot.configuration.database_path}"
+            self.get_url(self.bot.configuration.database_type),
+            **self.get_pool_options(sqlalchemy.pool.QueuePool),
+        )
+        self.async_engine = None
+        if self.is_async:
+            self.async_engine = self.create_async_engine()
+        
+        if self.is_sqlite:
+            sqlalchemy.event.listen(self.engine, "connect", self.set_sqlite_pragmas)
+            if self.async_engine is not None:
+                sqlalchemy.event.listen(self.async_engine.sync_engine, "connect", self.set_sqlite_pragmas)
+    
+    @property
+    def is_sqlite(self) -> bool:
+        return self.bot.configuration.database_type == "sqlite"
+    
+    @property
+    def sqlite_pragmas(self) -> Dict[str, Any]:
+        pragmas = dict(SQLITE_PRAGMAS)
+        for key, value in self.bot.configuration.database_sqlite.items():
+            if key not in pragmas:
+                raise ValueError(f"Unknown sqlite setting {key}")
+            # the values are written in the query
+            if isinstance(pragmas[key], int):
+                value = int(value)
+            elif not str(value).isalpha():
+                raise ValueError(f"Invalid value {value!r} for the sqlite setting {key}")
+            pragmas[key] = value
+        return pragmas
+    
+    def set_sqlite_pragmas(self, dbapi_connection: Any, connection_record: Any) -> None:
+        cursor = dbapi_connection.cursor()
+        for key, value in self.sqlite_pragmas.items():
+            cursor.execute(f"PRAGMA {key}={value}")
+        cursor.close()
+    
+    def check_sqlite(self) -> None:
+        # logs the settings in effect, sqlite silently ignores the values it can't apply
+        logger = self.bot.get_logger("database")
+        with self.engine.connect() as connection:
+            for key, expected in self.sqlite_pragmas.items():
+                value = connection.exec_driver_sql(f"PRAGMA {key}").scalar()
+                value = SQLITE_PRAGMA_NAMES.get(key, {}).get(value, value)
+                if str(value).lower() == str(expected).lower():
+                    logger.info(f"sqlite {key} = {value}")
+                else:
+                    logger.warning(f"sqlite {key} = {value} instead of {expected}")
+    
+    @property
+    def is_async(self) -> bool:
+        return self.bot.configuration.database_async
+    
+    def get_url(self, driver: str) -> str:
+        return f"{driver}://{self.bot.configuration.database_location}/{self.bot.configuration.database_path}"
+    
+    def get_pool_options(self, poolclass: type) -> Dict[str, Any]:
+        options = {
+            key: value
+            for key, value in self.bot.configuration.database_pool.items()
+            if key in ("pool_size", "max_overflow", "pool_recycle", "pool_timeout")
+        }
+        if len(options) > 0:
+            # the default pool of sqlite doesn't accept any of these options
+            options["poolclass"] = poolclass
+        return options
+    
+    @property
+    def pool_stats(self) -> Dict[str, Any]:
+        pool = self.engine.pool
+        if isinstance(pool, sqlalchemy.pool.QueuePool):
+            return {
+                "size": pool.size(),
+                "checked_in": pool.checkedin(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+            }
+        return {"status": pool.status()}
+    
+    def create_async_engine(self) -> sqlalchemy.ext.asyncio.AsyncEngine:
+        database_type = self.bot.configuration.database_type
+        if database_type not in ASYNC_DRIVERS:
+            raise ValueError(f"No asyncio driver is known for the {database_type} database type")
+        return sqlalchemy.ext.asyncio.create_async_engine(
+            self.get_url(ASYNC_DRIVERS[database_type]),
+            **self.get_pool_options(sqlalchemy.pool.AsyncAdaptedQueuePool),
         )
         
     def connect(self) -> None:
         self.Session = sqlalchemy.orm.sessionmaker(bind=self.engine)
-        self.session: sqlalchemy.orm.Session = self.Session()
+        # objects loaded in a unit of work stay usable once it's over
+        self.ScopedSession = sqlalchemy.orm.sessionmaker(
+            bind=self.engine,
+            expire_on_commit=False,
+        )
+        self._session: sqlalchemy.orm.Session = self.Session()
+        if self.async_engine is not None:
+            # objects stay usable once the session is closed
+            self.AsyncSession = sqlalchemy.orm.sessionmaker(
+                bind=self.async_engine,
+                class_=sqlalchemy.ext.asyncio.AsyncSession,
+                expire_on_commit=False,
+            )
+    
+    @property
+    def session(self) -> sqlalchemy.orm.Session:
+        session = _current_session.get()
+        if session is not None:
+            return session
+        return self._session
+    
+    @contextlib.contextmanager
+    def session_scope(self) -> Iterator[sqlalchemy.orm.Session]:
+        if _current_session.get() is not None: # nested unit of work
+            yield _current_session.get()
+            return
+        
+        session = self.ScopedSession()
+        token = _current_session.set(session)
+        try:
+            yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            _current_session.reset(token)
+            session.close()
+    
+    def async_session(self) -> sqlalchemy.ext.asyncio.AsyncSession:
+        if self.async_engine is None:
+            raise RuntimeError("The async database mode is disabled")
+        return self.AsyncSession()
     
     def close(self) -> None:
-        self.session.close()
+        self._session.close()
+    
+    async def dispose(self) -> None:
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
 
     def add(self, object: Base) -> None:
         if not issubclass(object, Base):
@@ -35,6 +204,54 @@ class Database:
         if object not in self.models:
             self.models.append(object)
     
-    def create_all(self) -> None:
-        for object in self.models:
-            object.metadata.create_all(self.engine)
\ No newline at end of file
+    def create_all(self, *objects: Base) -> None:
+        # the models share one metadata, their missing tables are created at once
+        self.Base.metadata.create_all(
+            self.engine,
+            tables=[object.__table__ for object in (*self.models, *objects)],
+        )
+
+def unit_of_work(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    # runs a handler in its own database session, committed at each await and when it returns
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        for arg in args:
+            if isinstance(arg, nextcord.Interaction):
+                database = arg.client.database
+                break
+        else:
+            database = args[0].bot.database
+        
+        with database.session_scope() as session:
+            return await _commit_on_suspend(func(*args, **kwargs), session)
+    
+    return wrapper
+
+@types.coroutine
+def _commit_on_suspend(coroutine: Coroutine[Any, Any, T], session: sqlalchemy.orm.Session) -> Generator[Any, Any, T]:
+    # drives the handler, its transaction is committed whenever it waits for something else,
+    # so no database lock or connection is held during a response or a download.
+    # a handler is therefore not atomic: what it wrote before an await stays committed
+    # if it fails afterwards, only the changes made since its last await are rolled back
+    value = None
+    error = None
+    while True:
+        try:
+            if error is not None:
+                future = coroutine.throw(error)
+            else:
+                future = coroutine.send(value)
+        except StopIteration as stop:
+            return stop.value
+        if session.in_transaction():
+            try:
+                session.commit()
+            except:
+                coroutine.close()
+                raise
+        try:
+            value = yield future
+            error = None
+        except BaseException as e:
+            value = None
+            error = e
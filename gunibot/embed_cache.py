@@ -0,0 +1,77 @@
+from __future__ import annotations
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+from collections import OrderedDict
+
+import time
+
+import nextcord
+
+__all__ = [
+    "EmbedCache",
+]
+
+class EmbedCache:
+    # serialized embeds, valid until the version of their object is bumped
+    def __init__(self, ttl: float = 300, maxsize: int = 1000) -> None:
+        # the ttl bounds the staleness of what isn't versioned, like the names of the users
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # key -> [version, builds in progress], only kept while an embed of the key is built
+        self._versions: Dict[Hashable, List[int]] = {}
+        # key -> (expiration, payload)
+        self._cache: OrderedDict[Hashable, Tuple[float, Dict[str, Any]]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+        }
+
+    def bump(self, key: Hashable) -> None:
+        # on every change of the object, deletion included
+        building = self._versions.get(key)
+        if building is not None:
+            building[0] += 1
+        self._cache.pop(key, None)
+
+    async def get(
+        self,
+        key: Hashable,
+        build: Callable[[], Awaitable[nextcord.Embed]],
+    ) -> nextcord.Embed:
+        cached = self._cache.get(key)
+        if cached is not None:
+            expiration, payload = cached
+            if expiration > time.monotonic():
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return nextcord.Embed.from_dict(payload)
+            del self._cache[key]
+
+        self.misses += 1
+        building = self._versions.setdefault(key, [0, 0])
+        version = building[0]
+        building[1] += 1
+        try:
+            embed = await build()
+        finally:
+            building[1] -= 1
+            if building[1] == 0:
+                del self._versions[key]
+        # unless the object changed while the embed was built
+        if building[0] == version:
+            self._cache[key] = (time.monotonic() + self.ttl, embed.to_dict())
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return embed
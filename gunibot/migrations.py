@@ -0,0 +1,118 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List
+
+import sqlalchemy
+import sqlalchemy.orm
+
+from .database import Base
+
+if TYPE_CHECKING:
+    from .bot import Gunibot
+
+__all__ = [
+    "SchemaVersion",
+    "MigrationRunner",
+    "add_column",
+    "create_index",
+    "create_table",
+]
+
+Migration = Callable[[sqlalchemy.engine.Connection], None]
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_versions"
+
+    namespace: str = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    version: int = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
+
+# the migrations can run again on a database which is already up to date,
+# so these helpers do nothing when the change is already there
+
+def add_column(connection: sqlalchemy.engine.Connection, column: sqlalchemy.Column) -> None:
+    table = column.table
+    columns = [column['name'] for column in sqlalchemy.inspect(connection).get_columns(table.name)]
+    if column.name not in columns:
+        connection.execute(sqlalchemy.text(
+            f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+        ))
+
+def create_index(connection: sqlalchemy.engine.Connection, table: sqlalchemy.Table, name: str) -> None:
+    for index in table.indexes:
+        if index.name == name:
+            index.create(connection, checkfirst=True)
+            return
+    raise ValueError(f"The table {table.name} has no index named {name}")
+
+def create_table(connection: sqlalchemy.engine.Connection, table: sqlalchemy.Table) -> None:
+    table.create(connection, checkfirst=True)
+
+class MigrationRunner:
+    def __init__(self, bot: Gunibot) -> None:
+        self.bot = bot
+        self.logger = self.bot.get_logger("database")
+        # namespace -> migrations, the version of a namespace is the number of migrations applied
+        self.migrations: Dict[str, List[Migration]] = {}
+
+    def add(self, namespace: str, migrations: Iterable[Migration]) -> None:
+        self.migrations[namespace] = list(migrations)
+
+    @staticmethod
+    def get_namespace(object: Base) -> str:
+        # the package of the model, like the __package__ of the module registering the migrations
+        return object.__module__.rpartition(".")[0] or object.__module__
+
+    @property
+    def targets(self) -> Dict[str, int]:
+        targets = {
+            self.get_namespace(object): 0
+            for object in self.bot.database.models
+        }
+        for namespace, migrations in self.migrations.items():
+            targets[namespace] = len(migrations)
+        return targets
+
+    def get_versions(self) -> Dict[str, int]:
+        try:
+            with self.bot.database.engine.connect() as connection:
+                return dict(connection.execute(
+                    sqlalchemy.select(
+                        SchemaVersion.namespace,
+                        SchemaVersion.version,
+                    )
+                ).all())
+        except sqlalchemy.exc.DBAPIError: # the table doesn't exist yet
+            return {}
+
+    def run(self) -> None:
+        versions = self.get_versions()
+        pending = {
+            namespace: target
+            for namespace, target in self.targets.items()
+            if versions.get(namespace, -1) < target
+        }
+        if len(pending) == 0:
+            return
+
+        self.bot.database.create_all(SchemaVersion)
+        for namespace, target in pending.items():
+            migrations = self.migrations.get(namespace, [])
+            with self.bot.database.engine.begin() as connection:
+                # a namespace without a version has never been migrated, even if its tables exist
+                for version in range(versions.get(namespace, 0), target):
+                    self.logger.info(f"Migrating {namespace} to the version {version + 1}")
+                    migrations[version](connection)
+
+                if namespace in versions:
+                    connection.execute(
+                        sqlalchemy.update(
+                            SchemaVersion
+                        ).where(
+                            SchemaVersion.namespace == namespace,
+                        ).values(version=target)
+                    )
+                else:
+                    connection.execute(
+                        sqlalchemy.insert(
+                            SchemaVersion
+                        ).values(namespace=namespace, version=target)
+                    )
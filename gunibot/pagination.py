@@ -0,0 +1,77 @@
+from __future__ import annotations
+from typing import Any, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar, Union
+
+import itertools
+
+import nextcord
+
+from .components import ComponentTemplate, RenderedComponents
+from .router import ComponentRouter, encode_id
+
+__all__ = [
+    "PAGE_SIZE",
+    "Page",
+    "PageTemplate",
+]
+
+T = TypeVar("T")
+
+# items shown by a page of a list
+PAGE_SIZE = 10
+
+class Page(Generic[T]):
+    # a page of a keyset pagination, the cursors are the ids of its first and last items
+    __slots__ = ("items", "has_previous", "has_next")
+
+    def __init__(self, items: List[T], has_previous: bool, has_next: bool) -> None:
+        self.items = items
+        self.has_previous = has_previous
+        self.has_next = has_next
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Iterable[T],
+        limit: int,
+        cursor: Optional[Any] = None,
+        backwards: bool = False,
+    ) -> Page[T]:
+        # the rows are queried with one more than the limit, to know if another page follows
+        items = list(itertools.islice(rows, limit + 1))
+        more = len(items) > limit
+        del items[limit:]
+        if backwards: # queried in the reverse order, from the cursor
+            items.reverse()
+            return cls(items, more, True)
+        return cls(items, cursor is not None, more)
+
+class PageTemplate:
+    # the previous and next buttons of a list, routed to "namespace:previous" and "namespace:next"
+    def __init__(self, namespace: str) -> None:
+        self._templates: Dict[Tuple[bool, bool], ComponentTemplate] = {
+            (has_previous, has_next): ComponentTemplate([
+                nextcord.ui.Button(
+                    custom_id=ComponentRouter.custom_id(namespace, "previous", "{0}"),
+                    style=nextcord.ButtonStyle.secondary,
+                    emoji="◀",
+                    label="Précédent",
+                    disabled=not has_previous,
+                ),
+                nextcord.ui.Button(
+                    custom_id=ComponentRouter.custom_id(namespace, "next", "{1}"),
+                    style=nextcord.ButtonStyle.secondary,
+                    emoji="▶",
+                    label="Suivant",
+                    disabled=not has_next,
+                ),
+            ])
+            for has_previous in (True, False)
+            for has_next in (True, False)
+        }
+
+    def render(self, page: Page, first: Union[int, str], last: Union[int, str]) -> RenderedComponents:
+        # the ids are encoded, the other cursors are given already formatted
+        return self._templates[(page.has_previous, page.has_next)].render(
+            encode_id(first) if isinstance(first, int) else first,
+            encode_id(last) if isinstance(last, int) else last,
+        )
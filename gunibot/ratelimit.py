@@ -0,0 +1,95 @@
+from __future__ import annotations
+from typing import Hashable, Optional
+from collections import OrderedDict
+
+import asyncio
+import time
+
+__all__ = [
+    "TokenBucket",
+    "RateLimiter",
+]
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def delay(self, tokens: float = 1) -> float:
+        self._refill()
+        if self.tokens >= tokens:
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens: float = 1) -> None:
+        self._refill()
+        self.tokens -= tokens
+
+    def penalize(self, seconds: float) -> None:
+        # empties the bucket for the given duration, e.g. after a 429
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self, tokens: float = 1) -> None:
+        while (delay := self.delay(tokens)) > 0:
+            await asyncio.sleep(delay)
+        self.consume(tokens)
+
+class RateLimiter:
+    # a global bucket plus one bucket per route, e.g. per discord channel
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        route_rate: float,
+        route_capacity: float,
+        max_routes: int = 10000,
+    ) -> None:
+        self.bucket = TokenBucket(rate, capacity)
+        self.route_rate = route_rate
+        self.route_capacity = route_capacity
+        self.max_routes = max_routes
+        self._routes: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+    def get_route(self, route: Hashable) -> TokenBucket:
+        try:
+            bucket = self._routes[route]
+        except KeyError:
+            bucket = TokenBucket(self.route_rate, self.route_capacity)
+            self._routes[route] = bucket
+            if len(self._routes) > self.max_routes:
+                self._evict()
+        else:
+            self._routes.move_to_end(route)
+        return bucket
+
+    def _evict(self) -> None:
+        # a full bucket holds no state, it can be recreated at any time
+        for route, bucket in list(self._routes.items()):
+            if len(self._routes) <= self.max_routes:
+                break
+            if bucket.full:
+                del self._routes[route]
+
+    async def acquire(self, route: Optional[Hashable] = None) -> None:
+        if route is not None:
+            await self.get_route(route).acquire()
+        await self.bucket.acquire()
+
+    def penalize(self, seconds: float, route: Optional[Hashable] = None) -> None:
+        if route is not None:
+            self.get_route(route).penalize(seconds)
+        else:
+            self.bucket.penalize(seconds)
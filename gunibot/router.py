@@ -0,0 +1,137 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Tuple
+
+import base64
+import binascii
+import time
+
+import nextcord
+
+if TYPE_CHECKING:
+    from .bot import Gunibot
+
+__all__ = [
+    "encode_id",
+    "decode_id",
+    "ComponentRouter",
+]
+
+Handler = Callable[..., Awaitable[None]]
+
+def encode_id(id: int) -> str:
+    # little endian bytes without the leading zeros nor the padding, 2 characters for ids below 256
+    raw = id.to_bytes(max(1, (id.bit_length() + 7) // 8), byteorder='little')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_id(encoded: str) -> int:
+    # also reads the padded standard base64 of the first custom ids
+    encoded = encoded.replace('-', '+').replace('_', '/')
+    try:
+        raw = base64.b64decode(encoded + '=' * (-len(encoded) % 4), validate=True)
+    except binascii.Error:
+        raise ValueError(f"Invalid encoded id {encoded!r}")
+    return int.from_bytes(raw, byteorder='little')
+
+class HandlerStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, elapsed: float) -> None:
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    @property
+    def average(self) -> float:
+        return self.total / self.calls if self.calls > 0 else 0.0
+
+class ComponentRouter:
+    # dispatches the component interactions on the "namespace:action" prefix of their custom_id
+    def __init__(self, bot: Gunibot) -> None:
+        self.bot = bot
+        self.logger = self.bot.get_logger("router")
+        self._handlers: Dict[str, Handler] = {}
+        # the prefixes of the custom ids sent before the router, (prefix, route)
+        self._legacy: List[Tuple[str, str]] = []
+        self._stats: Dict[str, HandlerStats] = {}
+
+    @staticmethod
+    def custom_id(namespace: str, action: str, *args: object) -> str:
+        return ":".join((namespace, action, *map(str, args)))
+
+    def add(self, namespace: str, action: str, handler: Handler) -> None:
+        route = f"{namespace}:{action}"
+        if route in self._handlers:
+            raise ValueError(f"A handler is already registered for {route}")
+        self._handlers[route] = handler
+        self._stats[route] = HandlerStats()
+
+    def add_legacy(self, prefix: str, namespace: str, action: str) -> None:
+        # the rest of the custom id is given to the handler as its only argument
+        self._legacy.append((prefix, f"{namespace}:{action}"))
+
+    def remove(self, namespace: str) -> None:
+        routes = [route for route in self._handlers if route.startswith(f"{namespace}:")]
+        for route in routes:
+            del self._handlers[route]
+        self._legacy = [
+            (prefix, route)
+            for prefix, route in self._legacy
+            if route not in routes
+        ]
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            route: {
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "average": stats.average,
+                "max": stats.max,
+            }
+            for route, stats in self._stats.items()
+            if route in self._handlers
+        }
+
+    def resolve(self, custom_id: str) -> Tuple[str, List[str]]:
+        namespace, _, rest = custom_id.partition(":")
+        action, _, rest = rest.partition(":")
+        route = f"{namespace}:{action}"
+        if route in self._handlers:
+            return route, rest.split(":") if rest else []
+        for prefix, route in self._legacy:
+            if custom_id.startswith(prefix):
+                return route, [custom_id[len(prefix):]]
+        raise KeyError(custom_id)
+
+    async def on_interaction(self, inter: nextcord.Interaction) -> None:
+        if inter.type != nextcord.InteractionType.component:
+            return
+        try:
+            route, args = self.resolve(inter.data['custom_id'])
+        except KeyError: # a view of nextcord, or not ours
+            return
+
+        stats = self._stats[route]
+        start = time.perf_counter()
+        try:
+            await self._handlers[route](inter, *args)
+        except Exception:
+            stats.errors += 1
+            self.logger.exception(f"The handler of {route} failed")
+            await self.reply_error(inter)
+        finally:
+            stats.record(time.perf_counter() - start)
+
+    async def reply_error(self, inter: nextcord.Interaction) -> None:
+        # the user would otherwise only see "the interaction failed"
+        try:
+            await inter.send(
+                "Une erreur est survenue, réessaye plus tard.",
+                ephemeral=True,
+            )
+        except nextcord.HTTPException:
+            self.logger.exception("Unable to report the error to the user")
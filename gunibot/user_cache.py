@@ -0,0 +1,96 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from collections import OrderedDict
+
+import asyncio
+import time
+
+import nextcord
+
+if TYPE_CHECKING:
+    from .bot import Gunibot
+
+__all__ = [
+    "UserCache",
+]
+
+class UserCache:
+    def __init__(
+        self,
+        bot: Gunibot,
+        ttl: float = 600,
+        negative_ttl: float = 300,
+        maxsize: int = 10000,
+    ) -> None:
+        self.bot = bot
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+
+        # user_id -> (user or None for deleted accounts, expiration)
+        self._cache: OrderedDict[int, Tuple[Optional[nextcord.User], float]] = OrderedDict()
+        self._inflight: Dict[int, asyncio.Future] = {}
+
+        self.gateway_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        lookups = self.gateway_hits + self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._cache),
+            "gateway_hits": self.gateway_hits,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (lookups - self.misses) / lookups if lookups > 0 else 0.0,
+        }
+
+    def _store(self, user_id: int, user: Optional[nextcord.User]) -> None:
+        ttl = self.ttl if user is not None else self.negative_ttl
+        self._cache[user_id] = (user, time.monotonic() + ttl)
+        self._cache.move_to_end(user_id)
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._cache.pop(user_id, None)
+
+    async def _fetch(self, user_id: int) -> Optional[nextcord.User]:
+        try:
+            user = await self.bot.fetch_user(user_id)
+        except nextcord.NotFound: # deleted account
+            user = None
+        self._store(user_id, user)
+        return user
+
+    async def get(self, user_id: int) -> Optional[nextcord.User]:
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            self.gateway_hits += 1
+            return user
+
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            user, expiration = cached
+            if expiration > time.monotonic():
+                self.hits += 1
+                self._cache.move_to_end(user_id)
+                return user
+            del self._cache[user_id]
+
+        future = self._inflight.get(user_id)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._fetch(user_id))
+            self._inflight[user_id] = future
+            future.add_done_callback(lambda _: self._inflight.pop(user_id, None))
+        else:
+            self.coalesced += 1
+        # a cancelled caller mustn't cancel the fetch shared with the others
+        return await asyncio.shield(future)
@@ -0,0 +1,150 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING, Any, Dict, Optional, Set, Tuple
+
+import asyncio
+
+import sqlalchemy
+import sqlalchemy.orm
+
+if TYPE_CHECKING:
+    from .bot import Gunibot
+    from .database import Base
+
+__all__ = [
+    "WriteBehind",
+]
+
+Key = Tuple[type, Any]
+
+class WriteBehind:
+    # collects the changes made by the interactions and writes them in one transaction
+    def __init__(
+        self,
+        bot: Gunibot,
+        delay: float = 1,
+        threshold: int = 100,
+    ) -> None:
+        self.bot = bot
+        self.logger = self.bot.get_logger("database")
+        self.delay = delay
+        self.threshold = threshold
+
+        # (model, primary key) -> changed column values
+        self._changes: Dict[Key, Dict[str, Any]] = {}
+        self._deletes: Set[Key] = set()
+        self._timer: Optional[asyncio.Handle] = None
+
+        self.flushes = 0
+        self.written = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._changes) + len(self._deletes)
+
+    @staticmethod
+    def get_key(object: Base) -> Key:
+        identity = sqlalchemy.inspect(object).identity
+        if identity is None:
+            raise ValueError("Only persistent objects can be written behind")
+        return type(object), identity[0]
+
+    def stage(self, object: Base) -> None:
+        key = self.get_key(object)
+        if key in self._deletes:
+            return
+        state = sqlalchemy.inspect(object)
+        changes = self._changes.setdefault(key, {})
+        for attribute in state.mapper.column_attrs:
+            if state.attrs[attribute.key].history.has_changes():
+                value = getattr(object, attribute.key)
+                changes[attribute.key] = value
+                # the session of the interaction has nothing left to write
+                sqlalchemy.orm.attributes.set_committed_value(object, attribute.key, value)
+        self._schedule()
+
+    def delete(self, object: Base) -> None:
+        key = self.get_key(object)
+        self._changes.pop(key, None)
+        self._deletes.add(key)
+        self._schedule()
+
+    def is_deleting(self, model: type) -> bool:
+        return any(deleted is model for deleted, _ in self._deletes)
+
+    def overlay(self, object: Optional[Base]) -> Optional[Base]:
+        # applies the pending changes to an object loaded from the database
+        if object is None:
+            return None
+        key = self.get_key(object)
+        if key in self._deletes:
+            return None
+        for attribute, value in self._changes.get(key, {}).items():
+            sqlalchemy.orm.attributes.set_committed_value(object, attribute, value)
+        return object
+
+    def _schedule(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        # never flush inline, the caller's session may still be open
+        if len(self) >= self.threshold:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = loop.call_soon(self.flush)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.delay, self.flush)
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if len(self) == 0:
+            return
+
+        changes, deletes = self._changes, self._deletes
+        self._changes, self._deletes = {}, set()
+        self.flushes += 1
+        try:
+            self._write(changes, deletes)
+        except Exception:
+            self.logger.exception(f"Unable to write {len(changes) + len(deletes)} objects at once")
+            # isolates the objects which can't be written
+            for key, values in changes.items():
+                self._write_one({key: values}, set())
+            for key in deletes:
+                self._write_one({}, {key})
+
+    def _write_one(self, changes: Dict[Key, Dict[str, Any]], deletes: Set[Key]) -> None:
+        try:
+            self._write(changes, deletes)
+        except Exception:
+            self.dropped += 1
+            self.logger.exception(f"Dropping the changes of {next(iter(changes or deletes))}")
+
+    def _write(self, changes: Dict[Key, Dict[str, Any]], deletes: Set[Key]) -> None:
+        identities: Dict[type, Set[Any]] = {}
+        for model, identity in (*changes, *deletes):
+            identities.setdefault(model, set()).add(identity)
+
+        with self.bot.database.Session() as session:
+            # one query per model loads every object to write
+            objects: Dict[Key, Base] = {}
+            for model, ids in identities.items():
+                primary_key = sqlalchemy.inspect(model).primary_key[0]
+                for object in session.query(model).filter(primary_key.in_(ids)):
+                    objects[self.get_key(object)] = object
+
+            for key, values in changes.items():
+                object = objects.get(key)
+                if object is None: # deleted in the meantime
+                    continue
+                for attribute, value in values.items():
+                    setattr(object, attribute, value)
+            for key in deletes:
+                object = objects.get(key)
+                if object is not None:
+                    session.delete(object)
+            session.commit()
+        self.written += len(changes) + len(deletes)